@@ -1,49 +1,411 @@
-from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for, Response
+import io
 import os
+import queue
 import tempfile
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 import shutil
-from kmlToSql import process_kml_file, process_directory, get_kml_files_from_directory
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
+from kmlToSql import (convert_kml_file, process_directory, process_file_list, get_kml_files_from_directory,
+                      OUTPUT_WRITERS,
+                      COMPRESSION_SUFFIXES, available_compressions, open_text_output, configure_logging,
+                      KML_INPUT_SUFFIXES, kml_base_name, expand_kml_inputs)
+from kmlJobs import JobStore, JobRunner
+from kmlUploads import (UploadError, create_upload, load_upload, upload_status, append_chunk, pending_files,
+                        update_settings)
+from kmlMetrics import MetricsStore, conversion_metrics, profiled
+from kmlColumnar import SUFFIX as COLUMNAR_SUFFIX
+from kmlSpatial import parse_bbox
 import json
+import logging
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'  # Mude isso para produção
 
 # Configurações
-UPLOAD_FOLDER = 'uploads'
-RESULTS_FOLDER = 'results'
-ALLOWED_EXTENSIONS = {'kml'}
+UPLOAD_FOLDER = os.path.abspath('uploads')
+RESULTS_FOLDER = os.path.abspath('results')
+# KML, KMZ, KML comprimido com gzip e .zip com vários KMLs (lidos sem extrair para o disco)
+ALLOWED_EXTENSIONS = KML_INPUT_SUFFIXES
+# KML de referência do filtro espacial: um único KML (sem .zip nem .kcol), guardado
+# numa subpasta do job para não entrar na lista de arquivos convertidos
+FILTER_POLYGON_EXTENSIONS = tuple(suffix for suffix in KML_INPUT_SUFFIXES if suffix not in ('.zip', COLUMNAR_SUFFIX))
+FILTER_POLYGON_FOLDER = 'filtro'
+# Banco para a carga direta (formato 'database'); desabilitada se não configurado.
+# Use caminho absoluto para SQLite: sqlite:////dados/zonas.db
+DATABASE_URL = os.environ.get('KML_DATABASE_URL')
+# Cache de conversões: reenvios do mesmo KML com as mesmas opções não são reconvertidos.
+CACHE_FOLDER = os.path.abspath(os.environ.get('KML_CACHE_DIR', 'cache'))
+CACHE_MAX_BYTES = int(os.environ.get('KML_CACHE_MAX_MB', '512')) * 1024 * 1024
+
+# Estado dos jobs de conversão, compartilhado entre os processos do gunicorn
+JOBS_DB = os.path.abspath(os.environ.get('KML_JOBS_DB', 'jobs.db'))
+# Conversões simultâneas por processo (cada job usa sua própria pasta)
+JOB_THREADS = int(os.environ.get('KML_JOB_THREADS', '4'))
+# Tempo, em segundos, que uploads e resultados de um job ficam disponíveis
+RESULTS_TTL = int(os.environ.get('KML_RESULTS_TTL', '3600'))
+# Intervalo mínimo entre duas coletas de arquivos expirados
+CLEANUP_INTERVAL = 60
+# Tamanho sugerido das partes no envio em partes (/api/uploads)
+UPLOAD_CHUNK_SIZE = int(os.environ.get('KML_UPLOAD_CHUNK_MB', '8')) * 1024 * 1024
+# Pasta dos perfis (cProfile) dos jobs enviados com profile=1; desabilitado se não configurado
+PROFILE_FOLDER = os.environ.get('KML_PROFILE_DIR')
+# Logs: INFO mostra só o resumo de cada arquivo (DEBUG inclui cada placemark);
+# KML_JSON_LOG grava também um resumo JSON por arquivo ('-' para a saída padrão)
+configure_logging(os.environ.get('KML_LOG_LEVEL', 'INFO'), os.environ.get('KML_JSON_LOG'))
+logger = logging.getLogger("app")
 
 # Cria as pastas necessárias
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
+if PROFILE_FOLDER:
+    PROFILE_FOLDER = os.path.abspath(PROFILE_FOLDER)
+    os.makedirs(PROFILE_FOLDER, exist_ok=True)
+
+job_store = JobStore(JOBS_DB)
+# Métricas de /metrics no mesmo banco dos jobs, somadas por todos os processos
+metrics_store = MetricsStore(JOBS_DB)
+job_runner = JobRunner(job_store, max_workers=JOB_THREADS, metrics=metrics_store)
+
+_cleanup_lock = threading.Lock()
+_last_cleanup = [0.0]
+
+# Conversões antecipadas dos arquivos já recebidos nos envios em partes, por job
+_prefetch_lock = threading.Lock()
+_prefetch_executor = [None]
+_prefetches = {}
+
+# Compressões oferecidas para o SQL (zstd só se o pacote zstandard estiver instalado)
+COMPRESSIONS = available_compressions()
+
+# Tipo MIME dos downloads de SQL, por compressão
+SQL_MIMETYPES = {None: 'application/sql', 'gzip': 'application/gzip', 'zstd': 'application/zstd'}
 
 def allowed_file(filename):
     """Verifica se o arquivo tem extensão permitida"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(ALLOWED_EXTENSIONS)
+
+def parse_jobs(value):
+    """Converte o campo 'jobs' do formulário, limitado ao número de núcleos do servidor"""
+    try:
+        jobs = int(value)
+    except (TypeError, ValueError):
+        return 1
+    return max(1, min(jobs, os.cpu_count() or 1))
+
+def parse_output_format(value):
+    """Valida o campo 'output_format' do formulário (padrão: sql)"""
+    if not value:
+        return 'sql'
+    if value == 'database' and not DATABASE_URL:
+        return None
+    return value if value in OUTPUT_WRITERS else None
+
+def parse_compression(value):
+    """Valida o campo 'compression' do formulário (vazio: sem compressão; False se inválido)"""
+    if not value or value == 'none':
+        return None
+    return value if value in COMPRESSIONS else False
+
+def parse_filters(form):
+    """
+    Valida os campos 'bbox' e 'clean_coordinates' do formulário.
+    
+    Returns:
+        dict or None: Opções do filtro espacial e da limpeza ({} se nenhuma foi
+            pedida), ou None se o bbox for inválido
+    """
+    filters = {}
+    if form.get('bbox'):
+        try:
+            filters['bbox'] = parse_bbox(form.get('bbox'))
+        except ValueError:
+            return None
+    if str(form.get('clean_coordinates', '')).lower() in ('1', 'true', 'on'):
+        filters['clean_coordinates'] = True
+    return filters
+
+def filter_polygon_file(files, filters):
+    """
+    Valida o campo 'filter_polygon' (KML com os polígonos da área de interesse).
+    
+    Args:
+        files: Arquivos do formulário (request.files)
+        filters (dict): Filtros já validados por parse_filters
+    
+    Returns:
+        tuple: (arquivo enviado ou None se o campo veio vazio, mensagem de erro ou None)
+    """
+    file = files.get('filter_polygon')
+    if file is None or file.filename == '':
+        return None, None
+    if not secure_filename(file.filename).lower().endswith(FILTER_POLYGON_EXTENSIONS):
+        return None, 'O polígono de referência deve ser um arquivo .kml, .kmz ou .kml.gz'
+    if filters.get('bbox'):
+        return None, 'Informe a área de interesse ou o polígono de referência, não os dois'
+    return file, None
+
+def save_filter_polygon(file, upload_dir, filters):
+    """Salva o KML de referência na subpasta FILTER_POLYGON_FOLDER do job e o registra em filters"""
+    reference_dir = os.path.join(upload_dir, FILTER_POLYGON_FOLDER)
+    os.makedirs(reference_dir, exist_ok=True)
+    file_path = os.path.join(reference_dir, secure_filename(file.filename))
+    file.save(file_path)
+    filters['filter_polygon'] = file_path
+
+def profile_path(job_id):
+    """Arquivo do perfil (cProfile) do job, se pedido com profile=1 e habilitado por KML_PROFILE_DIR"""
+    if not PROFILE_FOLDER or request.form.get('profile') not in ('1', 'true', 'on'):
+        return None
+    return os.path.join(PROFILE_FOLDER, f'{job_id}.prof')
+
+def conversion_options(output_format, results_dir, filters=None):
+    """Opções de conversão usadas pelas rotas web (filters: ver parse_filters)"""
+    # Leitura incremental: evita carregar KMLs grandes inteiros na memória do worker
+    options = {
+        'streaming': True,
+        'output_format': output_format,
+        'output_dir': results_dir,
+        'cache_dir': CACHE_FOLDER,
+        'cache_max_bytes': CACHE_MAX_BYTES
+    }
+    if output_format == 'database':
+        options['database_url'] = DATABASE_URL
+    if filters:
+        options.update(filters)
+    return options
 
-def clean_old_files():
-    """Remove arquivos antigos das pastas de upload e resultados"""
+def zip_results(results_dir, zip_filename, filenames):
+    """Empacota arquivos da pasta de resultados num .zip e retorna o nome do zip"""
+    zip_path = os.path.join(results_dir, zip_filename)
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for filename in filenames:
+            zip_file.write(os.path.join(results_dir, filename), arcname=filename)
+    return zip_filename
+
+def clean_expired_files():
+    """
+    Remove uploads e resultados com mais de RESULTS_TTL segundos.
+    
+    Pastas de jobs em andamento são preservadas; envios em partes sem nenhuma
+    parte recebida há RESULTS_TTL segundos são descartados, com os registros.
+    A coleta roda no máximo uma vez a cada CLEANUP_INTERVAL segundos por processo.
+    """
+    now = time.time()
+    with _cleanup_lock:
+        if now - _last_cleanup[0] < CLEANUP_INTERVAL:
+            return
+        _last_cleanup[0] = now
+    
+    # Jobs de workers encerrados deixam de contar como ativos e expiram normalmente
+    job_runner.recover_stale()
+    expires_before = now - RESULTS_TTL
+    active_jobs = job_store.active_ids()
     for folder in [UPLOAD_FOLDER, RESULTS_FOLDER]:
         for filename in os.listdir(folder):
+            if filename in active_jobs:
+                continue
             file_path = os.path.join(folder, filename)
             try:
+                if os.path.getmtime(file_path) >= expires_before:
+                    continue
                 if os.path.isfile(file_path):
                     os.unlink(file_path)
                 elif os.path.isdir(file_path):
                     shutil.rmtree(file_path)
             except Exception as e:
-                print(f"Erro ao limpar arquivo {file_path}: {e}")
+                logger.warning(f"Erro ao limpar arquivo {file_path}: {e}")
+    job_store.delete_finished_before(expires_before)
+    
+    # Envios em partes abandonados: nunca concluídos, não têm finished_at. Um envio
+    # antigo ainda recebendo partes é mantido (cada parte renova a data da pasta)
+    abandoned = []
+    for job_id in job_store.uploading_before(expires_before):
+        upload_dir = os.path.join(UPLOAD_FOLDER, job_id)
+        try:
+            if os.path.isdir(upload_dir):
+                if os.path.getmtime(upload_dir) >= expires_before:
+                    continue
+                shutil.rmtree(upload_dir)
+        except Exception as e:
+            logger.warning(f"Erro ao limpar o envio abandonado {upload_dir}: {e}")
+            continue
+        abandoned.append(job_id)
+    job_store.delete(abandoned)
 
 @app.route('/')
 def index():
     """Página principal"""
-    return render_template('index.html')
+    return render_template('index.html', database_enabled=bool(DATABASE_URL), compressions=COMPRESSIONS)
+
+def write_consolidated_header(sql_output, file_count):
+    """Escreve o cabeçalho informativo do SQL consolidado"""
+    sql_output.write("-- ================================================\n")
+    sql_output.write("-- KML to SQL Converter - Resultados Consolidados\n")
+    sql_output.write(f"-- Arquivos enviados: {file_count}\n")
+    sql_output.write(f"-- Data de geração: {__import__('datetime').datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    sql_output.write("-- ================================================\n\n")
+
+def save_uploaded_files(files, upload_dir):
+    """Salva os arquivos KML enviados na pasta do job e retorna seus nomes"""
+    uploaded_files = []
+    for file in files:
+        if file and allowed_file(file.filename):
+            filename = secure_filename(file.filename)
+            file_path = os.path.join(upload_dir, filename)
+            file.save(file_path)
+            uploaded_files.append(filename)
+    return uploaded_files
+
+def job_response(job_id):
+    """Resposta das rotas de upload: o job foi enfileirado"""
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}',
+        'result_url': f'/api/jobs/{job_id}/result'
+    })
+
+def run_single_conversion(report, job_id, file_path, filename, output_format, compression=None, filters=None):
+    """Converte um único arquivo KML (executado em segundo plano pelo job_runner)"""
+    results_dir = os.path.join(RESULTS_FOLDER, job_id)
+    os.makedirs(results_dir, exist_ok=True)
+    options = conversion_options(output_format, results_dir, filters)
+    
+    if output_format == 'sql' and compression:
+        # O conversor escreve direto no arquivo comprimido
+        base_name = kml_base_name(filename)
+        sql_path = os.path.join(results_dir, f"output_inserts_{base_name}.sql{COMPRESSION_SUFFIXES[compression]}")
+        with open_text_output(sql_path, compression) as sql_output:
+            result = convert_kml_file(file_path, options, progress=report, output=sql_output)
+        result['output_file'] = sql_path
+    else:
+        result = convert_kml_file(file_path, options, progress=report)
+    
+    response = single_conversion_response(job_id, results_dir, filename, output_format, result)
+    response['metrics'] = conversion_metrics(result)
+    return response
+
+def single_conversion_response(job_id, results_dir, filename, output_format, result):
+    """Monta o resultado do job de um único arquivo a partir do resultado da conversão"""
+    if result['status'] == 'success' and output_format == 'database':
+        # Carga direta: não há arquivo para baixar
+        return {
+            'success': True,
+            'message': f"Arquivo carregado no banco: {result['rows_written']} linhas "
+                       f"({result['rows_per_second']:.0f} linhas/s).",
+            'cache': result['cache']
+        }
+    elif result['status'] == 'success':
+        # Encontra o arquivo SQL gerado
+        sql_filename = os.path.basename(result['output_file'])
+        if output_format == 'copy':
+            # Script de carga + TSVs são entregues juntos num .zip
+            base_name = kml_base_name(filename)
+            sql_filename = zip_results(results_dir, f"resultado_copy_{base_name}.zip",
+                                       [os.path.basename(f) for f in result['output_files']])
+        sql_path = os.path.join(results_dir, sql_filename)
+        
+        if os.path.exists(sql_path):
+            return {
+                'success': True, 
+                'message': 'Arquivo processado com sucesso!',
+                'download_url': f'/download/{job_id}/{sql_filename}',
+                'cache': result['cache']
+            }
+        else:
+            return {'success': False, 'error': 'Arquivo SQL não foi gerado'}
+    else:
+        return {'success': False, 'error': 'Erro ao processar o arquivo KML'}
+
+def run_batch_conversion(report, job_id, upload_dir, output_format, jobs, compression=None, filters=None):
+    """Converte um lote de arquivos KML (executado em segundo plano pelo job_runner)"""
+    results_dir = os.path.join(RESULTS_FOLDER, job_id)
+    os.makedirs(results_dir, exist_ok=True)
+    options = conversion_options(output_format, results_dir, filters)
+    
+    def report_files(done, total):
+        report(done, total, f'{done}/{total} arquivo(s) convertido(s)')
+    
+    # Processa os arquivos (a pasta é listada uma única vez, para o cabeçalho e a conversão)
+    # Arquivos .kcol enviados pelo usuário são entradas explícitas
+    kml_files = get_kml_files_from_directory(upload_dir, columnar=True)
+    consolidated_filename = None
+    if output_format == 'sql':
+        # O SQL de cada KML vai direto para o arquivo consolidado (comprimido, se pedido)
+        consolidated_filename = 'resultados_kml_consolidado.sql' + COMPRESSION_SUFFIXES.get(compression, '')
+        consolidated_path = os.path.join(results_dir, consolidated_filename)
+        with open_text_output(consolidated_path, compression) as consolidated_file:
+            write_consolidated_header(consolidated_file, len(kml_files))
+            stats = process_file_list(kml_files, options, jobs=jobs, progress=report_files,
+                                      output=consolidated_file)
+    else:
+        stats = process_file_list(kml_files, options, jobs=jobs, progress=report_files)
+    
+    response = batch_conversion_response(job_id, results_dir, output_format, stats, consolidated_filename)
+    response['metrics'] = conversion_metrics(stats)
+    return response
+
+def batch_conversion_response(job_id, results_dir, output_format, stats, consolidated_filename=None):
+    """Monta o resultado do job de um lote a partir das estatísticas da conversão"""
+    if stats['success'] > 0 and output_format == 'database':
+        # Carga direta: não há arquivo para baixar
+        return {
+            'success': True,
+            'message': f'Carga concluída! {stats["success"]} arquivo(s) carregado(s) no banco '
+                       f'({stats["rows_written"]} linhas).',
+            'stats': stats
+        }
+    elif stats['success'] > 0 and output_format == 'copy':
+        # Empacota scripts de carga e TSVs, com um script que carrega todos
+        copy_files = sorted(f for f in os.listdir(results_dir)
+                            if f.startswith('output_') and f.endswith(('.sql', '.tsv')))
+        loader_filename = 'carregar_todos.sql'
+        with open(os.path.join(results_dir, loader_filename), 'w', encoding='utf-8') as loader_file:
+            loader_file.write("-- KML to SQL Converter - Carga consolidada via COPY\n")
+            loader_file.write("-- Execute com: psql -f carregar_todos.sql (na pasta extraída do .zip)\n")
+            for filename in copy_files:
+                if filename.startswith('output_copy_'):
+                    loader_file.write(f"\\ir {filename}\n")
+        
+        zip_filename = zip_results(results_dir, 'resultados_kml_copy.zip', [loader_filename] + copy_files)
+        return {
+            'success': True,
+            'message': f'Processamento concluído! {stats["success"]} arquivo(s) processado(s) com sucesso.',
+            'stats': stats,
+            'download_url': f'/download/{job_id}/{zip_filename}'
+        }
+    elif stats['success'] > 0 and output_format == 'columnar':
+        # Um .kcol por KML, entregues juntos (já comprimidos por coluna)
+        columnar_files = sorted(f for f in os.listdir(results_dir) if f.endswith(COLUMNAR_SUFFIX))
+        zip_filename = zip_results(results_dir, 'resultados_kml_colunar.zip', columnar_files)
+        return {
+            'success': True,
+            'message': f'Processamento concluído! {stats["success"]} arquivo(s) processado(s) com sucesso.',
+            'stats': stats,
+            'download_url': f'/download/{job_id}/{zip_filename}'
+        }
+    elif stats['success'] > 0:
+        return {
+            'success': True,
+            'message': f'Processamento concluído! {stats["success"]} arquivo(s) processado(s) com sucesso.',
+            'stats': stats,
+            'download_url': f'/download/{job_id}/{consolidated_filename}'
+        }
+    else:
+        return {
+            'success': False, 
+            'error': 'Nenhum arquivo foi processado com sucesso',
+            'stats': stats
+        }
 
 @app.route('/upload-single', methods=['POST'])
 def upload_single_file():
-    """Processa um único arquivo KML"""
+    """Recebe um único arquivo KML e enfileira sua conversão"""
     if 'file' not in request.files:
         return jsonify({'success': False, 'error': 'Nenhum arquivo selecionado'})
     
@@ -52,51 +414,51 @@ def upload_single_file():
     if file.filename == '':
         return jsonify({'success': False, 'error': 'Nenhum arquivo selecionado'})
     
+    output_format = parse_output_format(request.form.get('output_format'))
+    if output_format is None:
+        return jsonify({'success': False, 'error': 'Formato de saída inválido'})
+    
+    compression = parse_compression(request.form.get('compression'))
+    if compression is False:
+        return jsonify({'success': False, 'error': 'Compressão inválida'})
+    
+    filters = parse_filters(request.form)
+    if filters is None:
+        return jsonify({'success': False, 'error': 'bbox inválido (use lon_min,lat_min,lon_max,lat_max)'})
+    
+    filter_polygon, error = filter_polygon_file(request.files, filters)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    
     if file and allowed_file(file.filename):
-        # Limpa arquivos antigos
-        clean_old_files()
+        # Remove uploads e resultados expirados
+        clean_expired_files()
         
-        # Salva o arquivo
+        # Salva o arquivo na pasta do job
         filename = secure_filename(file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        # Um .zip pode trazer vários KMLs: é convertido como um lote
+        kind = 'batch' if filename.lower().endswith('.zip') else 'single'
+        job_id = job_store.create(kind)
+        upload_dir = os.path.join(UPLOAD_FOLDER, job_id)
+        os.makedirs(upload_dir, exist_ok=True)
+        file_path = os.path.join(upload_dir, filename)
         file.save(file_path)
+        if filter_polygon:
+            save_filter_polygon(filter_polygon, upload_dir, filters)
         
-        try:
-            # Processa o arquivo
-            # Temporariamente muda o diretório de trabalho para a pasta de resultados
-            original_cwd = os.getcwd()
-            os.chdir(RESULTS_FOLDER)
-            
-            success = process_kml_file(os.path.join('..', file_path))
-            
-            os.chdir(original_cwd)
-            
-            if success:
-                # Encontra o arquivo SQL gerado
-                base_name = os.path.splitext(filename)[0]
-                sql_filename = f"output_inserts_{base_name}.sql"
-                sql_path = os.path.join(RESULTS_FOLDER, sql_filename)
-                
-                if os.path.exists(sql_path):
-                    return jsonify({
-                        'success': True, 
-                        'message': 'Arquivo processado com sucesso!',
-                        'download_url': f'/download/{sql_filename}'
-                    })
-                else:
-                    return jsonify({'success': False, 'error': 'Arquivo SQL não foi gerado'})
-            else:
-                return jsonify({'success': False, 'error': 'Erro ao processar o arquivo KML'})
-                
-        except Exception as e:
-            os.chdir(original_cwd)  # Garante que volta ao diretório original
-            return jsonify({'success': False, 'error': f'Erro interno: {str(e)}'})
+        if kind == 'batch':
+            job_runner.submit(kind, run_batch_conversion, job_id, upload_dir, output_format, 1, compression, filters,
+                              job_id=job_id, profile_path=profile_path(job_id))
+        else:
+            job_runner.submit(kind, run_single_conversion, job_id, file_path, filename, output_format, compression,
+                              filters, job_id=job_id, profile_path=profile_path(job_id))
+        return job_response(job_id)
     
     return jsonify({'success': False, 'error': 'Tipo de arquivo não permitido'})
 
 @app.route('/upload-multiple', methods=['POST'])
 def upload_multiple_files():
-    """Processa múltiplos arquivos KML"""
+    """Recebe múltiplos arquivos KML e enfileira a conversão do lote"""
     if 'files[]' not in request.files:
         return jsonify({'success': False, 'error': 'Nenhum arquivo selecionado'})
     
@@ -105,87 +467,386 @@ def upload_multiple_files():
     if not files or all(f.filename == '' for f in files):
         return jsonify({'success': False, 'error': 'Nenhum arquivo selecionado'})
     
-    # Limpa arquivos antigos
-    clean_old_files()
+    output_format = parse_output_format(request.form.get('output_format'))
+    if output_format is None:
+        return jsonify({'success': False, 'error': 'Formato de saída inválido'})
     
-    # Cria pasta temporária para os uploads
-    upload_dir = os.path.join(UPLOAD_FOLDER, 'batch')
-    os.makedirs(upload_dir, exist_ok=True)
+    compression = parse_compression(request.form.get('compression'))
+    if compression is False:
+        return jsonify({'success': False, 'error': 'Compressão inválida'})
     
-    uploaded_files = []
+    filters = parse_filters(request.form)
+    if filters is None:
+        return jsonify({'success': False, 'error': 'bbox inválido (use lon_min,lat_min,lon_max,lat_max)'})
+    
+    filter_polygon, error = filter_polygon_file(request.files, filters)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    
+    # Remove uploads e resultados expirados
+    clean_expired_files()
+    
+    # Cria a pasta de uploads do job
+    job_id = job_store.create('batch')
+    upload_dir = os.path.join(UPLOAD_FOLDER, job_id)
+    os.makedirs(upload_dir, exist_ok=True)
     
     # Salva todos os arquivos
-    for file in files:
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(upload_dir, filename)
-            file.save(file_path)
-            uploaded_files.append(filename)
+    uploaded_files = save_uploaded_files(files, upload_dir)
     
     if not uploaded_files:
+        job_store.update(job_id, status='failed', finished_at=time.time(), message='Nenhum arquivo KML válido foi enviado')
         return jsonify({'success': False, 'error': 'Nenhum arquivo KML válido foi enviado'})
+    if filter_polygon:
+        save_filter_polygon(filter_polygon, upload_dir, filters)
     
+    jobs = parse_jobs(request.form.get('jobs'))
+    job_runner.submit('batch', run_batch_conversion, job_id, upload_dir, output_format, jobs, compression, filters,
+                      job_id=job_id, profile_path=profile_path(job_id))
+    return job_response(job_id)
+
+def prefetch_conversion(job_id, file_path, output_format, filters=None):
+    """
+    Converte em segundo plano um arquivo que acabou de chegar num envio em partes.
+    
+    A conversão só aquece o cache (a saída vai para uma pasta temporária): quando
+    o envio é concluído, o lote reaproveita o resultado de cada arquivo já
+    convertido, de modo que o envio e a conversão se sobrepõem.
+    """
+    if not OUTPUT_WRITERS[output_format].cacheable:
+        return
+    with _prefetch_lock:
+        # Criado sob demanda: com gunicorn --preload, threads não sobrevivem ao fork
+        if _prefetch_executor[0] is None:
+            _prefetch_executor[0] = ThreadPoolExecutor(max_workers=JOB_THREADS, thread_name_prefix='kml-prefetch')
+        future = _prefetch_executor[0].submit(prefetch_file, file_path, output_format, filters)
+        _prefetches.setdefault(job_id, []).append(future)
+
+def prefetch_file(file_path, output_format, filters=None):
+    """Converte um arquivo (ou cada KML de um .zip) com as mesmas opções do lote, guardando no cache"""
     try:
-        # Processa os arquivos
-        original_cwd = os.getcwd()
-        os.chdir(RESULTS_FOLDER)
-        
-        stats = process_directory(os.path.join('..', upload_dir))
-        
-        os.chdir(original_cwd)
-        
-        if stats['success'] > 0:
-            # Cria um arquivo SQL consolidado com todos os resultados
-            consolidated_filename = 'resultados_kml_consolidado.sql'
-            consolidated_path = os.path.join(RESULTS_FOLDER, consolidated_filename)
-            
-            with open(consolidated_path, 'w', encoding='utf-8') as consolidated_file:
-                # Adiciona cabeçalho informativo
-                consolidated_file.write("-- ================================================\n")
-                consolidated_file.write("-- KML to SQL Converter - Resultados Consolidados\n")
-                consolidated_file.write(f"-- Arquivos processados: {stats['success']}\n")
-                consolidated_file.write(f"-- Data de geração: {__import__('datetime').datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                consolidated_file.write("-- ================================================\n\n")
-                
-                # Concatena todos os arquivos SQL gerados
-                for filename in sorted(os.listdir(RESULTS_FOLDER)):
-                    if filename.endswith('.sql') and filename != consolidated_filename:
-                        file_path = os.path.join(RESULTS_FOLDER, filename)
-                        
-                        # Adiciona separador para cada arquivo
-                        base_name = filename.replace('output_inserts_', '').replace('.sql', '')
-                        consolidated_file.write(f"-- ========== Arquivo: {base_name} ==========\n")
-                        
-                        with open(file_path, 'r', encoding='utf-8') as sql_file:
-                            content = sql_file.read()
-                            consolidated_file.write(content)
-                            if not content.endswith('\n'):
-                                consolidated_file.write('\n')
-                        
-                        consolidated_file.write(f"-- ========== Fim: {base_name} ==========\n\n")
-            
-            return jsonify({
-                'success': True,
-                'message': f'Processamento concluído! {stats["success"]} arquivo(s) processado(s) com sucesso.',
-                'stats': stats,
-                'download_url': f'/download/{consolidated_filename}'
-            })
-        else:
-            return jsonify({
-                'success': False, 
-                'error': 'Nenhum arquivo foi processado com sucesso',
-                'stats': stats
-            })
-            
+        with tempfile.TemporaryDirectory(prefix='kml_prefetch_') as temp_dir:
+            options = conversion_options(output_format, temp_dir, filters)
+            for kml_path in expand_kml_inputs(file_path):
+                convert_kml_file(kml_path, options)
     except Exception as e:
-        os.chdir(original_cwd)
-        return jsonify({'success': False, 'error': f'Erro interno: {str(e)}'})
+        logger.warning(f"Erro na conversão antecipada de {file_path}: {e}")
+
+def run_uploaded_batch(report, job_id, upload_dir, output_format, jobs, compression=None, filters=None):
+    """Converte um lote enviado em partes, depois das conversões antecipadas deste processo"""
+    with _prefetch_lock:
+        futures = _prefetches.pop(job_id, [])
+    if futures:
+        report(0, 1, 'Concluindo as conversões antecipadas')
+        wait(futures)
+    return run_batch_conversion(report, job_id, upload_dir, output_format, jobs, compression, filters)
+
+def upload_error_response(error):
+    """Resposta JSON de um UploadError"""
+    body = {'success': False, 'error': str(error)}
+    if error.received is not None:
+        body['received'] = error.received
+    return jsonify(body), error.status
+
+@app.route('/api/uploads', methods=['POST'])
+def upload_init():
+    """Inicia um envio em partes: recebe a lista de arquivos (nome, tamanho, sha256 opcional)"""
+    data = request.get_json(silent=True) or {}
+    
+    output_format = parse_output_format(data.get('output_format'))
+    if output_format is None:
+        return jsonify({'success': False, 'error': 'Formato de saída inválido'}), 400
+    
+    compression = parse_compression(data.get('compression'))
+    if compression is False:
+        return jsonify({'success': False, 'error': 'Compressão inválida'}), 400
+    
+    filters = parse_filters(data)
+    if filters is None:
+        return jsonify({'success': False, 'error': 'bbox inválido (use lon_min,lat_min,lon_max,lat_max)'}), 400
+    
+    files = []
+    for entry in data.get('files') or []:
+        filename = secure_filename(str(entry.get('name', '')))
+        if not allowed_file(filename):
+            return jsonify({'success': False, 'error': f"Tipo de arquivo não permitido: {entry.get('name')}"}), 400
+        try:
+            size = int(entry.get('size'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': f'Tamanho inválido para {filename}'}), 400
+        files.append({'name': filename, 'size': size, 'sha256': entry.get('sha256') or None})
+    
+    # Remove uploads e resultados expirados
+    clean_expired_files()
+    
+    job_id = job_store.create('batch')
+    upload_dir = os.path.join(UPLOAD_FOLDER, job_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    settings = {'output_format': output_format, 'compression': compression, 'jobs': parse_jobs(data.get('jobs')),
+                'filters': filters}
+    try:
+        manifest = create_upload(upload_dir, files, settings)
+    except UploadError as e:
+        job_store.update(job_id, status='failed', finished_at=time.time(), message=str(e))
+        return upload_error_response(e)
+    job_store.update(job_id, status='uploading', message='Recebendo os arquivos')
+    
+    for entry in upload_status(upload_dir, manifest):
+        if entry['complete']:
+            prefetch_conversion(job_id, os.path.join(upload_dir, entry['name']), output_format, filters)
+    return jsonify({
+        'success': True,
+        'upload_id': job_id,
+        'upload_url': f'/api/uploads/{job_id}',
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'files': upload_status(upload_dir, manifest)
+    })
+
+def load_open_upload(job_id):
+    """Pasta e manifesto de um envio em partes ainda aberto (UploadError se não houver)"""
+    job = job_store.get(job_id)
+    upload_dir = safe_join(UPLOAD_FOLDER, job_id)
+    manifest = load_upload(upload_dir) if job is not None and upload_dir is not None else None
+    if manifest is None:
+        raise UploadError('Envio não encontrado', 404)
+    if job['status'] != 'uploading':
+        raise UploadError('O envio já foi concluído', 409)
+    return upload_dir, manifest
+
+@app.route('/api/uploads/<job_id>', methods=['GET'])
+def upload_progress(job_id):
+    """Bytes já recebidos de cada arquivo, para retomar um envio interrompido"""
+    try:
+        upload_dir, manifest = load_open_upload(job_id)
+    except UploadError as e:
+        return upload_error_response(e)
+    return jsonify({'success': True, 'upload_id': job_id, 'files': upload_status(upload_dir, manifest)})
+
+@app.route('/api/uploads/<job_id>/<filename>', methods=['PUT'])
+def upload_chunk(job_id, filename):
+    """Acrescenta uma parte ao arquivo, a partir de ?offset= (cabeçalho X-Chunk-SHA256 opcional)"""
+    if request.content_length is None:
+        return jsonify({'success': False, 'error': 'Content-Length obrigatório'}), 411
+    try:
+        offset = int(request.args.get('offset', '0'))
+        upload_dir, manifest = load_open_upload(job_id)
+        received, complete = append_chunk(upload_dir, manifest, filename, offset, request.stream,
+                                          request.content_length, request.headers.get('X-Chunk-SHA256'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset inválido'}), 400
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    if complete:
+        # O arquivo já pode ser convertido enquanto os demais chegam
+        settings = manifest['settings']
+        prefetch_conversion(job_id, os.path.join(upload_dir, filename), settings['output_format'],
+                            settings['filters'])
+    return jsonify({'success': True, 'received': received, 'complete': complete})
+
+@app.route('/api/uploads/<job_id>/filter-polygon', methods=['POST'])
+def upload_filter_polygon(job_id):
+    """Recebe o KML de referência do filtro espacial de um envio em partes (antes das partes dos arquivos)"""
+    try:
+        upload_dir, manifest = load_open_upload(job_id)
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    filters = dict(manifest['settings']['filters'])
+    filter_polygon, error = filter_polygon_file(request.files, filters)
+    if filter_polygon is None:
+        return jsonify({'success': False, 'error': error or 'Nenhum arquivo selecionado'}), 400
+    save_filter_polygon(filter_polygon, upload_dir, filters)
+    update_settings(upload_dir, manifest, filters=filters)
+    return jsonify({'success': True})
+
+@app.route('/api/uploads/<job_id>/complete', methods=['POST'])
+def upload_complete(job_id):
+    """Conclui o envio em partes e enfileira a conversão do lote"""
+    try:
+        upload_dir, manifest = load_open_upload(job_id)
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    pending = pending_files(upload_dir, manifest)
+    if pending:
+        return jsonify({'success': False, 'error': f'Arquivo(s) ainda não recebido(s): {", ".join(pending)}',
+                        'files': upload_status(upload_dir, manifest)}), 409
+    
+    # Só um pedido de conclusão enfileira o lote, mesmo entre processos
+    if not job_store.transition(job_id, 'uploading', status='queued', message='Aguardando na fila'):
+        return jsonify({'success': False, 'error': 'O envio já foi concluído'}), 409
+    settings = manifest['settings']
+    job_runner.submit('batch', run_uploaded_batch, job_id, upload_dir, settings['output_format'], settings['jobs'],
+                      settings['compression'], settings['filters'], job_id=job_id, profile_path=profile_path(job_id))
+    return job_response(job_id)
+
+class ResponsePipe(io.RawIOBase):
+    """
+    Canal entre a thread que gera o SQL e a resposta HTTP.
+    
+    A fila é limitada: se o cliente baixa devagar, a conversão espera em vez
+    de acumular o resultado na memória. Se o cliente desiste do download, a
+    próxima escrita falha e a conversão é interrompida.
+    """
+    
+    def __init__(self, max_chunks=16):
+        self._chunks = queue.Queue(maxsize=max_chunks)
+        self._cancelled = threading.Event()
+    
+    def writable(self):
+        return True
+    
+    def _put(self, chunk):
+        while True:
+            if self._cancelled.is_set():
+                raise BrokenPipeError('Download interrompido pelo cliente')
+            try:
+                self._chunks.put(chunk, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    def write(self, data):
+        if data:
+            self._put(bytes(data))
+        return len(data)
+    
+    def close(self):
+        if not self.closed:
+            super().close()
+            self._put(None)
+    
+    def cancel(self):
+        self._cancelled.set()
+    
+    def chunks(self):
+        """Blocos escritos até o fechamento do canal"""
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                return
+            yield chunk
+
+def stream_consolidated_sql(job_id, upload_dir, file_count, compression, jobs, profile=None, filters=None):
+    """Converte o lote numa thread e entrega o SQL consolidado em blocos, à medida que é gerado"""
+    pipe = ResponsePipe()
+    
+    def convert(buffered):
+        with open_text_output(buffered, compression) as sql_output:
+            write_consolidated_header(sql_output, file_count)
+            return process_directory(upload_dir, conversion_options('sql', None, filters), jobs=jobs, output=sql_output,
+                                     columnar=True)
+    
+    def produce():
+        started = time.time()
+        job_store.update(job_id, status='running', started_at=started, message='Convertendo')
+        buffered = io.BufferedWriter(pipe, buffer_size=64 * 1024)
+        try:
+            stats = profiled(profile, convert, buffered)
+            result = {'success': stats['success'] > 0, 'stats': stats, 'metrics': conversion_metrics(stats)}
+            job_runner.observe('stream', 'done', result, started)
+            job_store.update(job_id, status='done', progress=100, finished_at=time.time(), message='Concluído',
+                             result=result)
+        except Exception as e:
+            logger.error(f"Erro ao gerar o SQL consolidado do job {job_id}: {e}")
+            result = {'success': False, 'error': f'Erro interno: {e}'}
+            job_runner.observe('stream', 'failed', result, started)
+            job_store.update(job_id, status='failed', finished_at=time.time(), error=str(e),
+                             message='Erro interno', result=result)
+        finally:
+            try:
+                buffered.close()
+            except OSError:
+                pass
+    
+    producer = threading.Thread(target=produce, name=f'kml-stream-{job_id}', daemon=True)
+    producer.start()
+    try:
+        yield from pipe.chunks()
+    finally:
+        pipe.cancel()
+        producer.join()
+
+@app.route('/convert-stream', methods=['POST'])
+def convert_stream():
+    """Converte os KMLs enviados e devolve o SQL consolidado em streaming (gzip/zstd opcionais)"""
+    files = request.files.getlist('files[]') or request.files.getlist('file')
+    
+    if not files or all(f.filename == '' for f in files):
+        return jsonify({'success': False, 'error': 'Nenhum arquivo selecionado'}), 400
+    
+    compression = parse_compression(request.form.get('compression'))
+    if compression is False:
+        return jsonify({'success': False, 'error': 'Compressão inválida'}), 400
+    
+    filters = parse_filters(request.form)
+    if filters is None:
+        return jsonify({'success': False, 'error': 'bbox inválido (use lon_min,lat_min,lon_max,lat_max)'}), 400
+    
+    filter_polygon, error = filter_polygon_file(request.files, filters)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    
+    # Remove uploads e resultados expirados
+    clean_expired_files()
+    
+    # Registrado como job para que a coleta de expirados preserve os uploads durante o download
+    job_id = job_store.create('stream')
+    job_runner.track(job_id)
+    upload_dir = os.path.join(UPLOAD_FOLDER, job_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    
+    uploaded_files = save_uploaded_files(files, upload_dir)
+    if not uploaded_files:
+        job_store.update(job_id, status='failed', finished_at=time.time(), message='Nenhum arquivo KML válido foi enviado')
+        return jsonify({'success': False, 'error': 'Nenhum arquivo KML válido foi enviado'}), 400
+    if filter_polygon:
+        save_filter_polygon(filter_polygon, upload_dir, filters)
+    
+    jobs = parse_jobs(request.form.get('jobs'))
+    download_name = 'resultados_kml_consolidado.sql' + COMPRESSION_SUFFIXES.get(compression, '')
+    return Response(
+        stream_consolidated_sql(job_id, upload_dir, len(uploaded_files), compression, jobs, profile_path(job_id),
+                                filters),
+        mimetype=SQL_MIMETYPES[compression],
+        headers={'Content-Disposition': f'attachment; filename={download_name}', 'X-Job-Id': job_id}
+    )
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """Status e progresso de um job de conversão"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'message': job['message'],
+        'result_url': f'/api/jobs/{job_id}/result'
+    })
 
-@app.route('/download/<filename>')
+@app.route('/api/jobs/<job_id>/result')
+def api_job_result(job_id):
+    """Resultado de um job concluído (202 enquanto ainda estiver em andamento)"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+    
+    if job['status'] not in ('done', 'failed'):
+        return jsonify({'success': False, 'status': job['status'], 'error': 'Conversão ainda em andamento'}), 202
+    
+    return jsonify(job['result'])
+
+@app.route('/download/<path:filename>')
 def download_file(filename):
     """Download do arquivo resultado"""
-    file_path = os.path.join(RESULTS_FOLDER, filename)
-    if os.path.exists(file_path):
+    file_path = safe_join(RESULTS_FOLDER, filename)
+    if file_path is not None and os.path.isfile(file_path):
         return send_file(file_path, as_attachment=True)
     else:
         flash('Arquivo não encontrado', 'error')
@@ -200,5 +861,11 @@ def api_status():
         'description': 'KML to SQL Converter Web Interface'
     })
 
+@app.route('/metrics')
+def metrics():
+    """Métricas das conversões (todos os processos) em formato texto do Prometheus"""
+    return Response(metrics_store.render(job_store.count_active()),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
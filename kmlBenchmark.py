@@ -0,0 +1,284 @@
+"""
+Benchmarks do KML to SQL Converter.
+
+Gera KMLs sintéticos (quantidade de placemarks, vértices por placemark,
+formato do ExtendedData e número de arquivos configuráveis) e mede a
+conversão em diferentes modos: leitura completa ou incremental, INSERTs por
+linha ou em lote, formato COPY e processamento de pastas em série ou em
+paralelo. Cada execução roda num processo separado, para que o pico de
+memória (RSS) medido seja só dela.
+
+Os resultados (vértices/s, MB/s de KML lido e pico de RSS) são gravados em
+JSON, para comparar versões e detectar regressões:
+
+    python3 kmlBenchmark.py --placemarks 2000 --vertices 500 --files 4
+    python3 kmlBenchmark.py --scenarios file-row file-stream --output antes.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import tempfile
+import time
+
+import kmlMetrics
+import kmlToSql
+
+# Formatos de ExtendedData reconhecidos por kmlToSql._extract_layer_name
+LAYOUTS = ["zona", "layer", "description", "Description", "Name"]
+
+# Cenários medidos: tipo da execução ("file" ou "directory"), opções de
+# conversão e número de processos (apenas no modo diretório)
+SCENARIOS = {
+    "file-row": {"kind": "file", "options": {}, "jobs": 1},
+    "file-stream": {"kind": "file", "options": {"streaming": True}, "jobs": 1},
+    "file-batch": {"kind": "file", "options": {"insert_mode": "batch"}, "jobs": 1},
+    "file-copy": {"kind": "file", "options": {"output_format": "copy"}, "jobs": 1},
+    "directory-serial": {"kind": "directory", "options": {}, "jobs": 1},
+    "directory-parallel": {"kind": "directory", "options": {}, "jobs": 0},
+}
+
+KML_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+              '<Document>\n<Folder>\n')
+KML_FOOTER = '</Folder>\n</Document>\n</kml>\n'
+
+def _extended_data(layout, name):
+    """Monta o trecho do placemark que identifica a zona no formato informado"""
+    if layout == "zona":
+        return (f'<ExtendedData><Data name="zona"><value>{name}</value></Data>'
+                f'<Data name="tipo"><value>URBANO</value></Data></ExtendedData>\n')
+    if layout == "layer":
+        return ('<ExtendedData><SchemaData schemaUrl="#dados">'
+                '<SimpleData name="TIPO">URBANO</SimpleData>'
+                f'<SimpleData name="layer">{name}</SimpleData></SchemaData></ExtendedData>\n')
+    if layout == "description":
+        return f'<description>{name} / CE</description>\n'
+    if layout == "Description":
+        # Formato do Google Earth; o sufixo " / UF" passa pela remoção da UF em Data:Description
+        return (f'<ExtendedData><Data name="Description"><value>{name} / CE</value></Data>'
+                f'<Data name="tipo"><value>URBANO</value></Data></ExtendedData>\n')
+    if layout == "Name":
+        return f'<ExtendedData><Data name="Name"><value>{name}</value></Data></ExtendedData>\n'
+    raise ValueError(f"Formato de ExtendedData inválido: {layout}")
+
+def _ring(rng, vertices):
+    """Gera um anel fechado irregular com o número de vértices informado"""
+    center_lon = rng.uniform(-60.0, -35.0)
+    center_lat = rng.uniform(-30.0, -2.0)
+    radius = rng.uniform(0.005, 0.05)
+    points = []
+    for i in range(vertices - 1):
+        angle = 2 * math.pi * i / (vertices - 1)
+        r = radius * rng.uniform(0.8, 1.2)
+        points.append(f"{center_lon + r * math.cos(angle):.7f},{center_lat + r * math.sin(angle):.7f},0")
+    points.append(points[0])
+    return " ".join(points)
+
+def generate_kml(path, placemarks, vertices, layout="layer", seed=0):
+    """
+    Gera um arquivo KML sintético.
+
+    Cada placemark é um polígono (anel fechado) com o número de vértices
+    informado, identificado pelo formato de ExtendedData escolhido.
+
+    Args:
+        path (str): Caminho do arquivo a gerar
+        placemarks (int): Quantidade de placemarks
+        vertices (int): Vértices por placemark (mínimo 4)
+        layout (str): Formato que identifica a zona (ver LAYOUTS)
+        seed (int): Semente do gerador aleatório, para arquivos reprodutíveis
+
+    Returns:
+        int: Tamanho do arquivo gerado, em bytes
+    """
+    rng = random.Random(seed)
+    vertices = max(vertices, 4)
+    with open(path, 'w', encoding='utf-8') as kml_file:
+        kml_file.write(KML_HEADER)
+        for index in range(1, placemarks + 1):
+            kml_file.write(
+                f'<Placemark>\n<name>Zona {index}</name>\n'
+                f'{_extended_data(layout, f"ZONA SINTETICA {seed}-{index}")}'
+                '<MultiGeometry><Polygon><outerBoundaryIs><LinearRing><coordinates>\n'
+                f'{_ring(rng, vertices)}\n'
+                '</coordinates></LinearRing></outerBoundaryIs></Polygon></MultiGeometry>\n'
+                '</Placemark>\n'
+            )
+        kml_file.write(KML_FOOTER)
+    return os.path.getsize(path)
+
+def generate_dataset(directory, files, placemarks, vertices, layout="layer"):
+    """
+    Gera uma pasta de KMLs sintéticos.
+
+    Args:
+        directory (str): Pasta de destino (criada se não existir)
+        files (int): Quantidade de arquivos
+        placemarks (int): Placemarks por arquivo
+        vertices (int): Vértices por placemark
+        layout (str): Formato que identifica a zona (ver LAYOUTS)
+
+    Returns:
+        list: Caminhos dos arquivos gerados
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seed in range(files):
+        path = os.path.join(directory, f"sintetico_{seed + 1:03d}.kml")
+        generate_kml(path, placemarks, vertices, layout, seed)
+        paths.append(path)
+    return paths
+
+def _peak_rss_mb():
+    """Pico de RSS do processo atual e dos filhos já encerrados, em MB (None fora do Unix)"""
+    # Cada cenário roda num processo próprio: aqui o pico do processo é o do cenário
+    peak = kmlMetrics.process_peak_rss_bytes()
+    return None if peak is None else peak / (1024 * 1024)
+
+def _run_in_child(connection, scenario, target, output_dir):
+    """Executa um cenário e envia as medições ao processo pai"""
+    kmlToSql.configure_logging("ERROR")
+    settings = SCENARIOS[scenario]
+    options = dict(settings["options"], output_dir=output_dir)
+    started = time.perf_counter()
+    if settings["kind"] == "file":
+        result = kmlToSql.convert_kml_file(target, options)
+        ok = result["status"] == "success"
+        vertices = result["vertices_in"]
+        rows = result["rows_written"]
+    else:
+        stats = kmlToSql.process_directory(target, options, jobs=settings["jobs"])
+        ok = stats["success"] == stats["total"]
+        vertices = stats["vertices_in"]
+        rows = stats["rows_written"]
+    elapsed = time.perf_counter() - started
+    output_bytes = sum(entry.stat().st_size for entry in os.scandir(output_dir) if entry.is_file())
+    connection.send({"ok": ok, "elapsed_seconds": elapsed, "vertices": vertices, "rows_written": rows,
+                     "output_bytes": output_bytes, "peak_rss_mb": _peak_rss_mb()})
+    connection.close()
+
+def run_scenario(scenario, target, work_dir):
+    """
+    Mede uma execução de um cenário num processo separado.
+
+    Args:
+        scenario (str): Nome do cenário (ver SCENARIOS)
+        target (str): Arquivo KML (cenários "file") ou pasta (cenários "directory")
+        work_dir (str): Pasta temporária para as saídas geradas
+
+    Returns:
+        dict: Medições: {"ok", "elapsed_seconds", "vertices", "rows_written",
+              "output_bytes", "peak_rss_mb", "vertices_per_second", "mb_per_second"}
+    """
+    if SCENARIOS[scenario]["kind"] == "file":
+        input_bytes = os.path.getsize(target)
+    else:
+        input_bytes = sum(os.path.getsize(path) for path in kmlToSql.get_kml_files_from_directory(target))
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as output_dir:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_run_in_child, args=(sender, scenario, target, output_dir))
+        process.start()
+        sender.close()
+        try:
+            measures = receiver.recv()
+        except EOFError:
+            measures = {"ok": False, "elapsed_seconds": 0.0, "vertices": 0, "rows_written": 0,
+                        "output_bytes": 0, "peak_rss_mb": None}
+        process.join()
+
+    elapsed = measures["elapsed_seconds"]
+    measures["input_bytes"] = input_bytes
+    measures["vertices_per_second"] = measures["vertices"] / elapsed if elapsed else 0.0
+    measures["mb_per_second"] = input_bytes / (1024 * 1024) / elapsed if elapsed else 0.0
+    return measures
+
+def run_benchmarks(scenarios, files, placemarks, vertices, layout="layer", repeat=3, work_dir=None):
+    """
+    Gera os dados sintéticos e mede os cenários escolhidos.
+
+    Args:
+        scenarios (list): Nomes dos cenários (ver SCENARIOS)
+        files (int): Arquivos gerados para os cenários de diretório
+        placemarks (int): Placemarks por arquivo
+        vertices (int): Vértices por placemark
+        layout (str): Formato que identifica a zona (ver LAYOUTS)
+        repeat (int): Execuções por cenário (o resumo usa a mais rápida)
+        work_dir (str or None): Pasta de trabalho (None: pasta temporária do sistema)
+
+    Returns:
+        dict: Parâmetros, ambiente e medições de cada cenário, pronto para JSON
+    """
+    report = {
+        "parameters": {"files": files, "placemarks": placemarks, "vertices": vertices,
+                       "layout": layout, "repeat": repeat},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count()},
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory(dir=work_dir) as base_dir:
+        data_dir = os.path.join(base_dir, "dados")
+        paths = generate_dataset(data_dir, files, placemarks, vertices, layout)
+        for scenario in scenarios:
+            target = paths[0] if SCENARIOS[scenario]["kind"] == "file" else data_dir
+            runs = [run_scenario(scenario, target, base_dir) for _ in range(repeat)]
+            best = min(runs, key=lambda run: run["elapsed_seconds"])
+            report["scenarios"][scenario] = {
+                "ok": all(run["ok"] for run in runs),
+                "best_seconds": best["elapsed_seconds"],
+                "vertices_per_second": best["vertices_per_second"],
+                "mb_per_second": best["mb_per_second"],
+                "peak_rss_mb": max((run["peak_rss_mb"] or 0) for run in runs) or None,
+                "runs": runs,
+            }
+    return report
+
+def print_report(report):
+    """Exibe o resumo das medições em forma de tabela"""
+    print(f"{'Cenário':<20} {'Tempo (s)':>10} {'Vértices/s':>12} {'MB/s':>8} {'RSS (MB)':>9}")
+    for scenario, summary in report["scenarios"].items():
+        rss = f"{summary['peak_rss_mb']:.1f}" if summary["peak_rss_mb"] else "-"
+        status = "" if summary["ok"] else "  ❌ falhou"
+        print(f"{scenario:<20} {summary['best_seconds']:>10.3f} {summary['vertices_per_second']:>12.0f} "
+              f"{summary['mb_per_second']:>8.2f} {rss:>9}{status}")
+
+def main():
+    """
+    Função principal do benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Mede a conversão de KMLs sintéticos")
+    parser.add_argument("--placemarks", type=int, default=1000, help="Placemarks por arquivo (padrão: 1000)")
+    parser.add_argument("--vertices", type=int, default=200, help="Vértices por placemark (padrão: 200)")
+    parser.add_argument("--files", type=int, default=4, help="Arquivos nos cenários de diretório (padrão: 4)")
+    parser.add_argument("--layout", choices=LAYOUTS, default="layer",
+                        help="Formato do ExtendedData que identifica a zona (padrão: layer)")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS),
+                        help="Cenários a medir (padrão: todos)")
+    parser.add_argument("--repeat", type=int, default=3, help="Execuções por cenário (padrão: 3)")
+    parser.add_argument("--work-dir", type=str, help="Pasta para os arquivos temporários")
+    parser.add_argument("--output", type=str, default="benchmark_results.json",
+                        help="Arquivo JSON dos resultados (padrão: benchmark_results.json)")
+    parser.add_argument("--generate", type=str, metavar="PASTA",
+                        help="Apenas gera os KMLs sintéticos na pasta informada, sem medir")
+    args = parser.parse_args()
+
+    if args.generate:
+        paths = generate_dataset(args.generate, args.files, args.placemarks, args.vertices, args.layout)
+        print(f"✅ {len(paths)} arquivo(s) gerado(s) em {args.generate}")
+        return 0
+
+    report = run_benchmarks(args.scenarios, args.files, args.placemarks, args.vertices,
+                            args.layout, max(args.repeat, 1), args.work_dir)
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2, ensure_ascii=False)
+    print_report(report)
+    print(f"\n📄 Resultados gravados em {args.output}")
+    return 0 if all(summary["ok"] for summary in report["scenarios"].values()) else 1
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,167 @@
+"""
+Cache de conversões do KML to SQL Converter.
+
+Cada entrada guarda, compactados num único .zip, os arquivos gerados por uma
+conversão e o dict de resultado. A chave é o hash SHA-256 do conteúdo do KML
+somado às opções que afetam a saída, de modo que reenviar o mesmo arquivo com
+as mesmas opções dispensa o parse e a conversão.
+
+O tamanho total do cache é limitado: ao gravar uma entrada, as menos usadas
+recentemente (pela data de modificação, renovada a cada acerto) são removidas.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+
+# Incrementar quando o formato das saídas mudar, invalidando entradas antigas
+CACHE_VERSION = 6
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger("kmlCache")
+
+class ConversionCache:
+    """Cache em disco de conversões, com remoção LRU por tamanho"""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, kml_path, base_name, options, open_input=None):
+        """
+        Calcula a chave de uma conversão.
+
+        Args:
+            kml_path (str): Caminho do arquivo KML
+            base_name (str): Nome base usado nos arquivos de saída
+            options (dict): Opções que afetam a saída
+            open_input (callable or None): Abre o conteúdo a ser hasheado como
+                stream binário (padrão: o próprio arquivo kml_path)
+
+        Returns:
+            str: Hash hexadecimal
+        """
+        digest = hashlib.sha256()
+        with (open_input() if open_input is not None else open(kml_path, 'rb')) as kml_file:
+            for chunk in iter(lambda: kml_file.read(_HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        # O nome base aparece no conteúdo de algumas saídas (ex.: script de carga do COPY)
+        header = json.dumps({"version": CACHE_VERSION, "base_name": base_name, "options": options},
+                            sort_keys=True, default=str)
+        digest.update(header.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.zip")
+
+    def get(self, key, output_dir=None):
+        """
+        Restaura uma conversão do cache.
+
+        Args:
+            key (str): Chave calculada por make_key
+            output_dir (str or None): Pasta onde restaurar os arquivos (None: diretório atual)
+
+        Returns:
+            dict or None: Resultado salvo da conversão (com os caminhos restaurados),
+                ou None se não houver entrada
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with zipfile.ZipFile(entry_path) as entry:
+                result = json.loads(entry.read('result.json'))
+                output_files = []
+                for file_name in result["output_files"]:
+                    arcname = os.path.basename(file_name)
+                    output_path = os.path.join(output_dir or "", arcname)
+                    output_files.append(output_path)
+                    with entry.open(arcname) as source, open(output_path, 'wb') as target:
+                        while True:
+                            chunk = source.read(_HASH_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            target.write(chunk)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        result["output_files"] = output_files
+        result["output_file"] = output_files[0] if output_files else None
+
+        # Renova a entrada para a política LRU
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """
+        Salva os arquivos de saída e o resultado de uma conversão.
+
+        Args:
+            key (str): Chave calculada por make_key
+            result (dict): Resultado de convert_kml_file
+        """
+        descriptor, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        os.close(descriptor)
+        try:
+            with zipfile.ZipFile(temp_path, 'w', compression=zipfile.ZIP_DEFLATED) as entry:
+                entry.writestr('result.json', json.dumps(result))
+                for file_name in result["output_files"]:
+                    entry.write(file_name, arcname=os.path.basename(file_name))
+            # Troca atômica: outros processos nunca veem uma entrada pela metade
+            os.replace(temp_path, self._entry_path(key))
+        except OSError as e:
+            logger.warning(f"Erro ao gravar no cache de conversões: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove as entradas menos usadas até o cache caber em max_bytes"""
+        with self._lock:
+            entries = []
+            total = 0
+            for file_name in os.listdir(self.cache_dir):
+                if not file_name.endswith('.zip'):
+                    continue
+                path = os.path.join(self.cache_dir, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+_caches = {}
+
+def get_cache(cache_dir, max_bytes):
+    """
+    Retorna o cache do diretório informado, criando-o na primeira chamada.
+
+    Args:
+        cache_dir (str): Diretório do cache
+        max_bytes (int): Tamanho máximo do cache em bytes
+
+    Returns:
+        ConversionCache: Cache compartilhado pelo processo
+    """
+    cache = _caches.get(cache_dir)
+    if cache is None or cache.max_bytes != max_bytes:
+        cache = _caches[cache_dir] = ConversionCache(cache_dir, max_bytes)
+    return cache
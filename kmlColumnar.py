@@ -0,0 +1,238 @@
+"""
+Formato colunar intermediário das zonas convertidas (.kcol).
+
+Um KML convertido com o formato "columnar" vira um arquivo binário compacto
+que é aceito como entrada no lugar do KML: reexportá-lo para SQL, COPY ou
+banco dispensa o parse do XML. O arquivo guarda duas tabelas:
+
+    anéis        zona (uint32, posição na lista de zonas do rodapé) e
+                 vértices (uint32) de cada placemark, na ordem do arquivo
+    coordenadas  x (longitude) e y (latitude) em float64, na ordem dos anéis
+
+As colunas são gravadas em grupos de linhas (row groups) à medida que a
+conversão avança, de modo que nem a escrita nem a leitura guardam o arquivo
+inteiro em memória. Cada coluna de um grupo tem os bytes dos valores
+separados por posição (o primeiro byte de todos os valores, depois o
+segundo...) e comprimidos com zlib: coordenadas próximas compartilham os
+bytes mais significativos e comprimem bem. Layout (little-endian):
+
+    MAGIC | grupo 1 | grupo 2 | ... | rodapé JSON | tamanho do rodapé (uint32) | MAGIC
+
+O rodapé traz os nomes das zonas, os totais e a posição de cada coluna.
+"""
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+SUFFIX = ".kcol"
+MAGIC = b"KMLCOL1\n"
+FORMAT_VERSION = 1
+
+# Vértices acumulados antes de gravar um grupo (16 bytes cada)
+ROW_GROUP_VERTICES = 256 * 1024
+
+# Nível do zlib: acima disso o ganho em colunas de float64 é pequeno
+ZLIB_LEVEL = 6
+
+# Colunas de cada grupo, com o tipo dos valores (código do array)
+COLUMNS = (("zona", "I"), ("vertices", "I"), ("x", "d"), ("y", "d"))
+
+_FOOTER_SIZE = struct.Struct("<I")
+
+def is_columnar(path):
+    """O caminho é de um arquivo colunar (pela extensão)"""
+    return path.lower().endswith(SUFFIX)
+
+def _encode(values):
+    """Serializa uma coluna: bytes little-endian separados por posição e comprimidos"""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    raw = values.tobytes()
+    size = values.itemsize
+    return zlib.compress(b"".join(raw[position::size] for position in range(size)), ZLIB_LEVEL)
+
+def _decode(data, typecode, count):
+    """Reconstrói uma coluna gravada por _encode"""
+    values = array(typecode)
+    size = values.itemsize
+    split = zlib.decompress(data)
+    if len(split) != count * size:
+        raise ValueError("coluna com tamanho inesperado")
+    raw = bytearray(len(split))
+    for position in range(size):
+        raw[position::size] = split[position * count:(position + 1) * count]
+    values.frombytes(raw)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+class ColumnarWriter:
+    """Grava os anéis das zonas num stream binário no formato colunar"""
+
+    def __init__(self, stream, source=None, row_group_vertices=ROW_GROUP_VERTICES):
+        """
+        Args:
+            stream: Stream binário aberto para escrita (fica a cargo de quem o abriu)
+            source (str or None): Nome do KML de origem, guardado no rodapé
+            row_group_vertices (int): Vértices por grupo de linhas
+        """
+        self._stream = stream
+        self.source = source
+        self._row_group_vertices = row_group_vertices
+        self._zona_ids = {}
+        self._row_groups = []
+        self._offset = len(MAGIC)
+        self.rings = 0
+        self.vertices = 0
+        self._new_group()
+        stream.write(MAGIC)
+
+    def _new_group(self):
+        self._columns = {name: array(typecode) for name, typecode in COLUMNS}
+
+    def add_ring(self, zona, coordinates):
+        """
+        Acrescenta um anel (placemark) da zona.
+
+        Args:
+            zona (str): Nome da zona
+            coordinates (array): Valores x, y intercalados
+        """
+        columns = self._columns
+        columns["zona"].append(self._zona_ids.setdefault(zona, len(self._zona_ids)))
+        columns["vertices"].append(len(coordinates) // 2)
+        columns["x"].extend(coordinates[0::2])
+        columns["y"].extend(coordinates[1::2])
+        if len(columns["x"]) >= self._row_group_vertices:
+            self._flush()
+
+    def _flush(self):
+        """Grava o grupo de linhas acumulado"""
+        columns = self._columns
+        if not columns["zona"]:
+            return
+        group = {"rings": len(columns["zona"]), "vertices": len(columns["x"]), "columns": {}}
+        for name, _typecode in COLUMNS:
+            data = _encode(columns[name])
+            self._stream.write(data)
+            group["columns"][name] = [self._offset, len(data)]
+            self._offset += len(data)
+        self._row_groups.append(group)
+        self.rings += group["rings"]
+        self.vertices += group["vertices"]
+        self._new_group()
+
+    def finish(self):
+        """Grava o último grupo e o rodapé; o stream não é fechado"""
+        self._flush()
+        footer = json.dumps({
+            "version": FORMAT_VERSION,
+            "source": self.source,
+            "zonas": list(self._zona_ids),
+            "rings": self.rings,
+            "vertices": self.vertices,
+            "row_groups": self._row_groups,
+        }, ensure_ascii=False).encode("utf-8")
+        self._stream.write(footer)
+        self._stream.write(_FOOTER_SIZE.pack(len(footer)))
+        self._stream.write(MAGIC)
+
+class ColumnarReader:
+    """
+    Lê um arquivo colunar gravado por ColumnarWriter.
+
+    Atributos: source, zonas (nomes, na ordem da primeira aparição), rings,
+    vertices e total_bytes (tamanho do arquivo).
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Caminho do arquivo .kcol
+
+        Raises:
+            OSError: Se o arquivo não puder ser aberto
+            ValueError: Se o arquivo não estiver no formato colunar (ou estiver truncado)
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._read_footer()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _read_footer(self):
+        tail = len(MAGIC) + _FOOTER_SIZE.size
+        self.total_bytes = self._file.seek(0, 2)
+        if self.total_bytes < len(MAGIC) + tail:
+            raise ValueError(f"Arquivo colunar inválido ou truncado: {self.path}")
+        self._file.seek(0)
+        head = self._file.read(len(MAGIC))
+        self._file.seek(-tail, 2)
+        trailer = self._file.read(tail)
+        if head != MAGIC or trailer[_FOOTER_SIZE.size:] != MAGIC:
+            raise ValueError(f"Arquivo colunar inválido ou truncado: {self.path}")
+        footer_size = _FOOTER_SIZE.unpack(trailer[:_FOOTER_SIZE.size])[0]
+        if footer_size > self.total_bytes - len(MAGIC) - tail:
+            raise ValueError(f"Arquivo colunar inválido ou truncado: {self.path}")
+        self._file.seek(-tail - footer_size, 2)
+        footer = json.loads(self._file.read(footer_size).decode("utf-8"))
+        if footer.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Versão do formato colunar não suportada: {footer.get('version')}")
+        self.source = footer["source"]
+        self.zonas = footer["zonas"]
+        self.rings = footer["rings"]
+        self.vertices = footer["vertices"]
+        self._row_groups = footer["row_groups"]
+
+    def _read_column(self, group, name, typecode, count):
+        offset, size = group["columns"][name]
+        self._file.seek(offset)
+        try:
+            return _decode(self._file.read(size), typecode, count)
+        except (zlib.error, ValueError) as e:
+            raise ValueError(f"Coluna '{name}' corrompida em {self.path}: {e}")
+
+    def iter_rings(self, progress=None):
+        """
+        Percorre os anéis na ordem em que foram gravados, um grupo de linhas por vez.
+
+        Args:
+            progress (callable or None): Chamado como progress(bytes_lidos, bytes_totais)
+                após cada grupo
+
+        Yields:
+            tuple: (nome da zona, array de valores x, y intercalados)
+        """
+        zonas = self.zonas
+        for group in self._row_groups:
+            columns = {name: self._read_column(group, name, typecode,
+                                               group["rings"] if typecode == "I" else group["vertices"])
+                       for name, typecode in COLUMNS}
+            # Volta ao layout intercalado usado no restante do pipeline
+            coordinates = array("d", bytes(16 * group["vertices"]))
+            coordinates[0::2] = columns["x"]
+            coordinates[1::2] = columns["y"]
+            if sum(columns["vertices"]) != group["vertices"]:
+                raise ValueError(f"Grupo de linhas inconsistente em {self.path}")
+            start = 0
+            for zona_id, vertices in zip(columns["zona"], columns["vertices"]):
+                end = start + 2 * vertices
+                yield zonas[zona_id], coordinates[start:end]
+                start = end
+            if progress is not None:
+                offset, size = group["columns"]["y"]
+                progress(offset + size, self.total_bytes)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,241 @@
+"""
+Operações geométricas sobre as coordenadas dos placemarks.
+
+Simplificação de polígonos: o motor de roteirização só precisa das bordas
+das zonas com precisão de alguns metros, então vértices que desviam menos
+que a tolerância da linha simplificada podem ser descartados.
+
+Métodos disponíveis:
+    dp  Douglas-Peucker: mantém os vértices que mais se afastam da reta entre
+        os extremos de cada trecho, enquanto o afastamento passar da tolerância
+    vw  Visvalingam-Whyatt: remove repetidamente o vértice cujo triângulo com
+        os vizinhos tem a menor área, enquanto ela for menor que tolerância²
+
+As coordenadas são projetadas uma única vez para metros (projeção
+equirretangular local, suficiente na escala de um município) em arrays de
+float64, e os algoritmos trabalham apenas com índices sobre os valores
+originais do KML, que são copiados sem alteração.
+
+Com o numpy instalado (opcional), a projeção e a busca do vértice mais
+distante de cada trecho do Douglas-Peucker são vetorizadas nos anéis com
+NUMPY_MIN_VERTICES vértices ou mais; sem ele, tudo roda nos laços em Python.
+Os dois caminhos fazem as mesmas operações em float64 e mantêm os mesmos
+vértices. O Visvalingam-Whyatt continua em Python: cada remoção altera a área
+dos vizinhos e depende da anterior (fila de prioridade), o que não se
+vetoriza.
+"""
+import heapq
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Raio médio da Terra em metros
+EARTH_RADIUS = 6371008.8
+
+# Abaixo disso (vértices do anel ou do trecho), chamar o numpy custa mais que o laço em Python
+NUMPY_MIN_VERTICES = 64
+
+def _project(coordinates):
+    """
+    Projeta os pares do KML em metros, relativos ao primeiro vértice.
+
+    Args:
+        coordinates (array): Valores longitude, latitude intercalados, como no KML
+
+    Returns:
+        tuple: (xs, ys) como arrays de float64 (numpy.ndarray nos anéis grandes,
+               se o numpy estiver instalado)
+    """
+    lons = coordinates[0::2]
+    lats = coordinates[1::2]
+    scale = math.radians(1) * EARTH_RADIUS
+    x_scale = scale * math.cos(math.radians(sum(lats) / len(lats)))
+    lon0 = lons[0]
+    lat0 = lats[0]
+    if numpy is not None and len(lons) >= NUMPY_MIN_VERTICES:
+        values = numpy.frombuffer(coordinates, dtype=numpy.float64)
+        return (values[0::2] - lon0) * x_scale, (values[1::2] - lat0) * scale
+    xs = array('d', [(lon - lon0) * x_scale for lon in lons])
+    ys = array('d', [(lat - lat0) * scale for lat in lats])
+    return xs, ys
+
+def _farthest(xs, ys, first, last, ax, ay, dx, dy):
+    """
+    Vértice de (first, last) mais distante da reta (ou do ponto, se dx = dy = 0).
+
+    Returns:
+        tuple: (medida da distância, índice); a medida é o produto vetorial² ou a
+               distância² ao ponto. Nos empates fica o maior índice
+    """
+    best = -1.0
+    index = first
+    if dx == 0 and dy == 0:
+        for i in range(first + 1, last):
+            px = xs[i] - ax
+            py = ys[i] - ay
+            value = px * px + py * py
+            if value >= best:
+                best = value
+                index = i
+    else:
+        for i in range(first + 1, last):
+            value = (xs[i] - ax) * dy - (ys[i] - ay) * dx
+            value *= value
+            if value >= best:
+                best = value
+                index = i
+    return best, index
+
+def _farthest_numpy(xs, ys, first, last, ax, ay, dx, dy):
+    """Mesmo que _farthest, sobre numpy.ndarray"""
+    px = xs[first + 1:last] - ax
+    py = ys[first + 1:last] - ay
+    if dx == 0 and dy == 0:
+        values = px * px + py * py
+    else:
+        values = px * dy - py * dx
+        values *= values
+    # argmax devolve a primeira ocorrência: procura de trás para frente para ficar com a última
+    offset = len(values) - 1 - int(numpy.argmax(values[::-1]))
+    return float(values[offset]), first + 1 + offset
+
+def douglas_peucker(xs, ys, tolerance):
+    """
+    Seleciona os vértices pelo método de Douglas-Peucker (iterativo, sem recursão).
+
+    Args:
+        xs (array or numpy.ndarray): Coordenadas x em metros
+        ys (array or numpy.ndarray): Coordenadas y em metros
+        tolerance (float): Afastamento máximo permitido, em metros
+
+    Returns:
+        list: Índices dos vértices mantidos, em ordem
+    """
+    count = len(xs)
+    keep = bytearray(count)
+    keep[0] = keep[count - 1] = 1
+    tolerance_sq = tolerance * tolerance
+    stack = [(0, count - 1)]
+    vectorized = numpy is not None and isinstance(xs, numpy.ndarray)
+    if vectorized:
+        # Trechos curtos seguem no laço em Python, que indexa listas mais rápido que o numpy
+        xs_array, ys_array = xs, ys
+        xs, ys = xs.tolist(), ys.tolist()
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        ax = xs[first]
+        ay = ys[first]
+        dx = xs[last] - ax
+        dy = ys[last] - ay
+        segment_sq = dx * dx + dy * dy
+        if segment_sq == 0:
+            dx = dy = 0.0
+        if vectorized and last - first > NUMPY_MIN_VERTICES:
+            distance_sq, index = _farthest_numpy(xs_array, ys_array, first, last, ax, ay, dx, dy)
+        else:
+            distance_sq, index = _farthest(xs, ys, first, last, ax, ay, dx, dy)
+        if segment_sq != 0:
+            # Distância à reta: (produto vetorial)² / |segmento|²; com extremos
+            # coincidentes (anel fechado), já é a distância² até o ponto
+            distance_sq /= segment_sq
+        if distance_sq > tolerance_sq:
+            keep[index] = 1
+            stack.append((index, last))
+            stack.append((first, index))
+
+    return [i for i in range(count) if keep[i]]
+
+def visvalingam(xs, ys, tolerance):
+    """
+    Seleciona os vértices pelo método de Visvalingam-Whyatt.
+
+    Args:
+        xs (array): Coordenadas x em metros
+        ys (array): Coordenadas y em metros
+        tolerance (float): Os vértices com área efetiva menor que tolerance² (m²) são removidos
+
+    Returns:
+        list: Índices dos vértices mantidos, em ordem
+    """
+    count = len(xs)
+    previous = list(range(-1, count - 1))
+    following = list(range(1, count + 1))
+    removed = bytearray(count)
+    threshold = tolerance * tolerance
+
+    def area(i):
+        a = previous[i]
+        c = following[i]
+        return abs((xs[a] - xs[i]) * (ys[c] - ys[i]) - (xs[c] - xs[i]) * (ys[a] - ys[i])) / 2
+
+    areas = [0.0] * count
+    heap = []
+    for i in range(1, count - 1):
+        areas[i] = area(i)
+        heap.append((areas[i], i))
+    heapq.heapify(heap)
+
+    while heap:
+        current, i = heapq.heappop(heap)
+        # Entradas desatualizadas (o vértice já saiu ou teve a área recalculada)
+        if removed[i] or current != areas[i]:
+            continue
+        if current >= threshold:
+            break
+        removed[i] = 1
+        a = previous[i]
+        c = following[i]
+        following[a] = c
+        previous[c] = a
+        for neighbor in (a, c):
+            if 0 < neighbor < count - 1:
+                # A área efetiva nunca diminui, para não remover vizinhos de pontos já descartados
+                areas[neighbor] = max(area(neighbor), current)
+                heapq.heappush(heap, (areas[neighbor], neighbor))
+
+    return [i for i in range(count) if not removed[i]]
+
+# Métodos de simplificação, indexados por options["simplify_method"]
+SIMPLIFY_METHODS = {
+    "dp": douglas_peucker,
+    "vw": visvalingam,
+}
+
+def simplify_coordinates(coordinates, tolerance, method="dp"):
+    """
+    Simplifica a linha/polígono de um placemark.
+
+    Args:
+        coordinates (array): Valores x, y intercalados, como extraídos do KML
+        tolerance (float): Tolerância em metros
+        method (str): "dp" (Douglas-Peucker) ou "vw" (Visvalingam-Whyatt)
+
+    Returns:
+        array: Valores x, y intercalados dos vértices mantidos
+    """
+    if len(coordinates) < 6 or tolerance <= 0:
+        return coordinates
+
+    xs, ys = _project(coordinates)
+    if method != "dp" and numpy is not None and isinstance(xs, numpy.ndarray):
+        # O Visvalingam-Whyatt indexa vértice a vértice: mais rápido sobre listas
+        xs, ys = xs.tolist(), ys.tolist()
+    kept = SIMPLIFY_METHODS[method](xs, ys, tolerance)
+
+    # Um anel fechado precisa de ao menos um triângulo; zonas menores que a
+    # tolerância são mantidas como estão em vez de degeneradas
+    closed = coordinates[0] == coordinates[-2] and coordinates[1] == coordinates[-1]
+    if closed and len(kept) < 4:
+        return coordinates
+    simplified = array('d')
+    for i in kept:
+        simplified.append(coordinates[2 * i])
+        simplified.append(coordinates[2 * i + 1])
+    return simplified
@@ -0,0 +1,351 @@
+"""
+Fila de conversões assíncronas da interface web.
+
+As rotas de upload apenas salvam os arquivos e registram um job; a conversão
+roda num pool de threads em segundo plano. O estado dos jobs (status,
+progresso e resultado) fica num banco SQLite compartilhado por todos os
+processos do gunicorn, de modo que qualquer worker responde a /api/jobs/<id>.
+
+Cada job guarda o pid do processo que o executa (owner_pid) e um heartbeat
+(heartbeat_at) renovado periodicamente por esse processo. Se o worker morre
+(reinício do gunicorn, OOM, timeout), o job ficaria para sempre na fila ou
+em execução: JobRunner.recover_stale marca como 'failed' os jobs cujo dono
+não existe mais ou cujo heartbeat parou.
+
+Ao fim de cada job, as medições da conversão (result["metrics"]) recebem a
+duração e são somadas às métricas do serviço (ver kmlMetrics). O pico de
+memória é do processo, não do job (os jobs dividem o processo), e só entra
+nas métricas do serviço.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import kmlMetrics
+
+logger = logging.getLogger("kmlJobs")
+
+# Intervalo entre as renovações do heartbeat dos jobs de um processo (segundos)
+HEARTBEAT_INTERVAL = 15
+
+# Sem heartbeat por mais que isso, o job é dado como órfão (segundos)
+STALE_AFTER = 120
+
+# Resultado dos jobs interrompidos pela morte do processo que os executava
+INTERRUPTED_ERROR = "O processo que executava a conversão foi encerrado"
+
+def _process_alive(pid):
+    """O processo com o pid informado ainda existe (neste host)"""
+    if not pid or os.name != "posix":
+        # Sem como verificar: fica só o critério do heartbeat
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class JobStore:
+    """Persistência dos jobs num arquivo SQLite"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, status TEXT, progress REAL, message TEXT, "
+                "result TEXT, error TEXT, created_at REAL, started_at REAL, finished_at REAL, "
+                "owner_pid INTEGER, heartbeat_at REAL)"
+            )
+            # Bancos criados antes do heartbeat: acrescenta as colunas
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("owner_pid", "INTEGER"), ("heartbeat_at", "REAL")):
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    def _connect(self):
+        # Uma conexão por operação: seguro entre threads e processos
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def create(self, kind):
+        """
+        Registra um novo job na fila.
+
+        Args:
+            kind (str): Tipo do job ("single", "batch" ou "stream")
+
+        Returns:
+            str: Id do job
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, kind, status, progress, message, created_at, owner_pid, heartbeat_at) "
+                "VALUES (?, ?, 'queued', 0, ?, ?, ?, ?)",
+                (job_id, kind, "Aguardando na fila", now, os.getpid(), now)
+            )
+        return job_id
+
+    def update(self, job_id, **fields):
+        """Atualiza campos do job (result é serializado em JSON)"""
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as connection:
+            connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def transition(self, job_id, from_status, **fields):
+        """
+        Atualiza o job só se ele ainda estiver no status informado.
+
+        Garante que, entre processos concorrentes, apenas um conclua a transição
+        (ex.: dois pedidos de conclusão do mesmo envio).
+
+        Returns:
+            bool: True se o job foi atualizado
+        """
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as connection:
+            cursor = connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ? AND status = ?",
+                                        (*fields.values(), job_id, from_status))
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        """
+        Retorna o estado de um job.
+
+        Args:
+            job_id (str): Id do job
+
+        Returns:
+            dict or None: Campos do job, ou None se não existir
+        """
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def count_active(self):
+        """Número de jobs na fila e em execução, por status"""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def active_ids(self):
+        """Ids dos jobs ainda na fila ou em execução"""
+        with self._connect() as connection:
+            rows = connection.execute("SELECT id FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        return {row[0] for row in rows}
+
+    def heartbeat(self, owner_pid):
+        """Renova o heartbeat dos jobs na fila ou em execução do processo informado"""
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner_pid = ? AND status IN ('queued', 'running')",
+                (time.time(), owner_pid)
+            )
+
+    def fail_stale(self, timestamp):
+        """
+        Marca como 'failed' os jobs órfãos: na fila ou em execução, com o processo
+        dono encerrado ou sem heartbeat desde o instante informado.
+
+        Args:
+            timestamp (float): Heartbeats anteriores a este instante são considerados parados
+
+        Returns:
+            list: Ids dos jobs marcados como 'failed'
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT id, owner_pid, COALESCE(heartbeat_at, started_at, created_at) FROM jobs "
+                "WHERE status IN ('queued', 'running')"
+            ).fetchall()
+        stale = [job_id for job_id, owner_pid, heartbeat_at in rows
+                 if heartbeat_at is None or heartbeat_at < timestamp or not _process_alive(owner_pid)]
+        failed = []
+        result = json.dumps({"success": False, "error": f"{INTERRUPTED_ERROR}. Envie os arquivos novamente."})
+        with self._connect() as connection:
+            for job_id in stale:
+                # Só se o job não tiver terminado nesse meio tempo
+                cursor = connection.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, message = ?, error = ?, result = ? "
+                    "WHERE id = ? AND status IN ('queued', 'running')",
+                    (time.time(), "Interrompido", INTERRUPTED_ERROR, result, job_id)
+                )
+                if cursor.rowcount == 1:
+                    failed.append(job_id)
+        return failed
+
+    def delete_finished_before(self, timestamp):
+        """Remove os registros de jobs encerrados antes do instante informado"""
+        with self._connect() as connection:
+            connection.execute("DELETE FROM jobs WHERE finished_at < ?", (timestamp,))
+
+    def uploading_before(self, timestamp):
+        """Ids dos envios em partes ainda abertos ('uploading') criados antes do instante informado"""
+        with self._connect() as connection:
+            rows = connection.execute("SELECT id FROM jobs WHERE status = 'uploading' AND created_at < ?",
+                                      (timestamp,)).fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, job_ids):
+        """Remove os registros dos jobs informados"""
+        with self._connect() as connection:
+            connection.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+
+class JobRunner:
+    """Executa os jobs num pool de threads e publica o progresso no JobStore"""
+
+    def __init__(self, store, max_workers=1, metrics=None):
+        self.store = store
+        self.max_workers = max_workers
+        # kmlMetrics.MetricsStore onde somar as medições dos jobs (None desativa)
+        self.metrics = metrics
+        self._executor = None
+        self._heartbeat_pid = None
+        self._lock = threading.Lock()
+        # Jobs deixados por processos de uma execução anterior
+        self.recover_stale()
+
+    def _get_executor(self):
+        # Criado sob demanda: com gunicorn --preload, threads não sobrevivem ao fork
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="kml-job")
+            return self._executor
+
+    def _start_heartbeat(self):
+        # Uma thread por processo (a do processo pai não sobrevive ao fork)
+        with self._lock:
+            if self._heartbeat_pid == os.getpid():
+                return
+            self._heartbeat_pid = os.getpid()
+        threading.Thread(target=self._heartbeat_loop, args=(os.getpid(),), name="kml-job-heartbeat",
+                         daemon=True).start()
+
+    def _heartbeat_loop(self, pid):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self.store.heartbeat(pid)
+            except sqlite3.Error as e:
+                logger.warning(f"Erro ao renovar o heartbeat dos jobs: {e}")
+
+    def track(self, job_id):
+        """
+        Registra o job como executado por este processo e mantém seu heartbeat.
+
+        Usado também pelos jobs que não passam pelo pool (ex.: o SQL em streaming).
+
+        Args:
+            job_id (str): Id do job
+        """
+        self.store.update(job_id, owner_pid=os.getpid(), heartbeat_at=time.time())
+        self._start_heartbeat()
+
+    def recover_stale(self):
+        """
+        Marca como 'failed' os jobs órfãos de processos encerrados (ver JobStore.fail_stale).
+
+        Returns:
+            list: Ids dos jobs recuperados
+        """
+        try:
+            failed = self.store.fail_stale(time.time() - STALE_AFTER)
+        except sqlite3.Error as e:
+            logger.warning(f"Erro ao recuperar jobs interrompidos: {e}")
+            return []
+        if failed:
+            logger.warning(f"⚠️ {len(failed)} job(s) interrompido(s) marcado(s) como falha: {', '.join(failed)}")
+        return failed
+
+    def submit(self, kind, task, *args, job_id=None, profile_path=None):
+        """
+        Enfileira uma tarefa.
+
+        A tarefa é chamada como task(report, *args) e deve retornar o dict de
+        resultado (o mesmo JSON que a rota retornaria de forma síncrona), com
+        as medições da conversão em "metrics" (ver kmlMetrics.conversion_metrics).
+        report(concluído, total, mensagem=None) publica o progresso.
+
+        Args:
+            kind (str): Tipo do job
+            task (callable): Função da conversão
+            job_id (str or None): Id já criado com store.create (senão cria um)
+            profile_path (str or None): Grava o perfil (cProfile) da tarefa neste arquivo
+
+        Returns:
+            str: Id do job
+        """
+        if job_id is None:
+            job_id = self.store.create(kind)
+        self.track(job_id)
+        self._get_executor().submit(self._run, job_id, kind, task, args, profile_path)
+        return job_id
+
+    def observe(self, kind, status, result, started):
+        """
+        Completa as medições de um job encerrado e as soma às métricas do serviço.
+
+        Args:
+            kind (str): Tipo do job
+            status (str): Status final ("done" ou "failed")
+            result (dict): Resultado do job; result["metrics"] é criado ou completado
+            started (float): Instante de início do job (time.time())
+        """
+        duration = time.time() - started
+        metrics = result.setdefault("metrics", {})
+        metrics["duration_seconds"] = round(duration, 3)
+        if self.metrics is None:
+            return
+        try:
+            self.metrics.observe_job(kind, status, duration, metrics)
+            # Amostrado ao fim de cada job, mas é o pico do processo inteiro
+            self.metrics.observe_process(kmlMetrics.process_peak_rss_bytes())
+        except sqlite3.Error as e:
+            logger.warning(f"Erro ao registrar as métricas do job: {e}")
+
+    def _run(self, job_id, kind, task, args, profile_path=None):
+        started = time.time()
+        self.store.update(job_id, status="running", started_at=started, message="Convertendo")
+        last_percent = [-1]
+
+        def report(done, total, message=None):
+            percent = int(100 * done / total) if total else 0
+            # Evita escrever no banco a cada placemark: só quando o percentual muda
+            if percent == last_percent[0] and message is None:
+                return
+            last_percent[0] = percent
+            fields = {"progress": min(percent, 99)}
+            if message is not None:
+                fields["message"] = message
+            self.store.update(job_id, **fields)
+
+        try:
+            result = kmlMetrics.profiled(profile_path, task, report, *args)
+        except Exception as e:
+            result = {'success': False, 'error': f'Erro interno: {e}'}
+            self.observe(kind, "failed", result, started)
+            self.store.update(job_id, status="failed", finished_at=time.time(), error=str(e),
+                              message="Erro interno", result=result)
+            return
+        self.observe(kind, "done", result, started)
+        self.store.update(job_id, status="done", progress=100, finished_at=time.time(),
+                          message="Concluído", result=result)
@@ -0,0 +1,165 @@
+"""
+Manifesto da conversão incremental do KML to SQL Converter.
+
+O manifesto de um KML guarda, para cada zona (nome da camada), os hashes das
+coordenadas de seus placemarks na ordem do arquivo, como estavam na última
+conversão. Na conversão seguinte, só as zonas novas, alteradas ou removidas
+geram SQL: as alteradas têm as coordenadas antigas apagadas antes de serem
+inseridas de novo, e as inalteradas não geram nada.
+
+O manifesto vale apenas para as mesmas opções de saída: se elas mudarem (ou
+o manifesto não existir), todas as zonas são apagadas e recarregadas.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+# Incrementar quando o formato do manifesto mudar
+MANIFEST_VERSION = 1
+
+# Decisões de ManifestDelta.check
+WRITE = "write"
+DELETE_AND_WRITE = "delete_and_write"
+SKIP = "skip"
+
+def manifest_path(manifest_dir, base_name):
+    """
+    Caminho do manifesto de um arquivo KML.
+
+    Args:
+        manifest_dir (str or None): Pasta dos manifestos (None: diretório atual)
+        base_name (str): Nome do KML sem extensão
+
+    Returns:
+        str: Caminho do arquivo JSON
+    """
+    return os.path.join(manifest_dir or "", f"manifest_{base_name}.json")
+
+def placemark_hash(coordinates):
+    """
+    Hash das coordenadas de um placemark.
+
+    Args:
+        coordinates (array): Valores x, y intercalados (float64)
+
+    Returns:
+        str: Hash hexadecimal
+    """
+    return hashlib.blake2b(coordinates.tobytes(), digest_size=16).hexdigest()
+
+class ManifestDelta:
+    """
+    Compara os placemarks de uma conversão com o manifesto da anterior.
+
+    Uso: check() para cada placemark válido, na ordem do arquivo; depois
+    finish() para as zonas que ficaram pendentes e save() quando a saída
+    estiver completa.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.previous = self._load()
+        self.current = {}
+        # Zonas já reescritas (com o DELETE, se necessário, antes do primeiro INSERT)
+        self.changed = set()
+        # Zonas que mudaram depois de placemarks já pulados: reescritas numa segunda passada
+        self.deferred = {}
+        self.removed = []
+        self.added = 0
+
+    def _load(self):
+        """Lê o manifesto anterior; None se não existir ou não valer para as opções atuais"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("options") != self.fingerprint:
+            return None
+        return manifest.get("zonas", {})
+
+    def check(self, layer, coordinates):
+        """
+        Decide o que fazer com um placemark.
+
+        Args:
+            layer (str): Nome da zona
+            coordinates (array): Coordenadas originais do placemark
+
+        Returns:
+            str: WRITE (escrever), DELETE_AND_WRITE (apagar a zona antiga e
+                escrever) ou SKIP (não escrever)
+        """
+        hashes = self.current.setdefault(layer, [])
+        position = len(hashes)
+        hashes.append(placemark_hash(coordinates))
+
+        if layer in self.changed:
+            return WRITE
+        if layer in self.deferred:
+            return SKIP
+        old = self.previous.get(layer) if self.previous is not None else None
+        if old is not None and position < len(old) and old[position] == hashes[-1]:
+            return SKIP
+        if position > 0:
+            # Os placemarks anteriores da zona foram pulados e precisam ser reescritos
+            self.deferred[layer] = True
+            return SKIP
+        self.changed.add(layer)
+        if self.previous is not None and old is None:
+            self.added += 1
+            return WRITE
+        return DELETE_AND_WRITE
+
+    def finish(self):
+        """
+        Conclui a comparação depois do último placemark.
+
+        Returns:
+            tuple: (zonas a reescrever por completo, zonas removidas do KML)
+        """
+        rewrite = dict(self.deferred)
+        removed = []
+        for layer, old in (self.previous or {}).items():
+            if layer in self.changed or layer in rewrite:
+                continue
+            hashes = self.current.get(layer)
+            if hashes is None:
+                removed.append(layer)
+            elif hashes != old:
+                # A zona perdeu placemarks do final
+                rewrite[layer] = True
+        self.deferred = rewrite
+        self.removed = removed
+        return list(rewrite), removed
+
+    def summary(self):
+        """
+        Contagem de zonas por situação (chamar após finish).
+
+        Returns:
+            dict: {"added": int, "changed": int, "removed": int, "unchanged": int}
+        """
+        changed = len(self.changed) + len(self.deferred) - self.added
+        return {
+            "added": self.added,
+            "changed": changed,
+            "removed": len(self.removed),
+            "unchanged": len(self.current) - self.added - changed,
+        }
+
+    def save(self):
+        """Grava o manifesto da conversão atual (troca atômica do arquivo)"""
+        directory = os.path.dirname(self.path) or "."
+        descriptor, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as manifest_file:
+                json.dump({"version": MANIFEST_VERSION, "options": self.fingerprint, "zonas": self.current},
+                          manifest_file, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
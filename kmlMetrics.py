@@ -0,0 +1,236 @@
+"""
+Métricas das conversões da interface web, em formato texto do Prometheus.
+
+Cada job concluído soma seus números (tempo por etapa, bytes lidos e
+gravados, vértices, linhas) a contadores guardados numa tabela do mesmo banco
+SQLite dos jobs. Como o banco é compartilhado por todos os processos do
+gunicorn, /metrics devolve os totais do serviço, seja qual for o worker que
+responder.
+
+Etapas medidas por kmlToSql (result["timings"], ver CONVERSION_STAGES):
+    parse     leitura do XML (descompressão incluída)
+    extract   validação do ExtendedData, nome da camada e coordenadas
+    filter    limpeza das coordenadas e filtro espacial (ver kmlSpatial)
+    simplify  simplificação dos polígonos (ver kmlGeometry)
+    write     escrita da saída (ou carga no banco)
+"""
+import json
+import math
+import sqlite3
+import sys
+
+# Limites (segundos) dos buckets do histograma de duração dos jobs
+JOB_DURATION_BUCKETS = [1, 5, 15, 60, 300, 600, math.inf]
+
+# Métricas expostas: nome -> (tipo, descrição)
+METRICS = {
+    "kml_jobs_total": ("counter", "Jobs de conversão encerrados, por tipo e status"),
+    "kml_job_duration_seconds": ("histogram", "Duração dos jobs de conversão, por tipo"),
+    "kml_stage_seconds_total": ("counter", "Tempo gasto em cada etapa da conversão"),
+    "kml_files_total": ("counter", "Arquivos KML convertidos, por status"),
+    "kml_cache_requests_total": ("counter", "Consultas ao cache de conversões, por resultado"),
+    "kml_input_bytes_total": ("counter", "Bytes de KML lidos (como armazenados, antes da descompressão)"),
+    "kml_output_bytes_total": ("counter", "Bytes de saída gerados"),
+    "kml_vertices_in_total": ("counter", "Vértices lidos dos KMLs"),
+    "kml_vertices_out_total": ("counter", "Vértices escritos após a simplificação"),
+    "kml_rows_written_total": ("counter", "Linhas de zona e coordenada geradas"),
+    "kml_process_peak_rss_bytes": ("gauge", "Maior pico de memória (RSS) entre os processos do serviço"),
+    "kml_jobs_active": ("gauge", "Jobs na fila ou em execução, por status"),
+}
+
+def process_peak_rss_bytes():
+    """
+    Pico de RSS do processo atual e dos filhos já encerrados, desde o início do processo.
+
+    Não é uma medida por job: os jobs simultâneos (e os anteriores) do mesmo
+    processo entram no pico.
+
+    Returns:
+        int or None: Bytes (None fora do Unix)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss é em bytes no macOS e em KB no Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def conversion_metrics(summary):
+    """
+    Resume as medições de uma conversão para o registro do job.
+
+    Args:
+        summary (dict): Resultado de kmlToSql.convert_kml_file ou estatísticas
+            de kmlToSql.process_directory
+
+    Returns:
+        dict: {"timings", "bytes_read", "bytes_written", "vertices_in",
+               "vertices_out", "rows_written", "files", "cache"}
+    """
+    if "files" in summary:
+        files = {"success": summary["success"], "no_valid_layers": summary["no_valid_layers"],
+                 "error": summary["errors"]}
+        cache = {"hit": summary["cache_hits"], "miss": summary["cache_misses"]}
+    else:
+        files = {summary["status"]: 1}
+        cache = {summary["cache"]: 1} if summary["cache"] else {}
+    return {
+        "timings": {stage: round(seconds, 6) for stage, seconds in summary["timings"].items()},
+        "bytes_read": summary["bytes_read"],
+        "bytes_written": summary["bytes_written"],
+        "vertices_in": summary["vertices_in"],
+        "vertices_out": summary["vertices_out"],
+        "rows_written": summary["rows_written"],
+        "files": files,
+        "cache": cache,
+    }
+
+def profiled(profile_path, function, *args, **kwargs):
+    """
+    Executa uma função, gravando o perfil do cProfile se profile_path for informado.
+
+    Só a thread atual é perfilada (processos filhos de jobs paralelos, não).
+
+    Args:
+        profile_path (str or None): Arquivo .prof (abra com pstats ou snakeviz)
+        function (callable): Função a executar
+
+    Returns:
+        O retorno da função
+    """
+    if not profile_path:
+        return function(*args, **kwargs)
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Outro perfil já ativo no processo (Python 3.12+ aceita um por vez)
+        return function(*args, **kwargs)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+def _format_value(value):
+    """Formata um valor de amostra (inteiros sem casa decimal)"""
+    if value == math.inf:
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _format_labels(labels):
+    """Formata os rótulos de uma amostra, com os escapes do formato texto"""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class MetricsStore:
+    """Contadores das conversões num banco SQLite compartilhado entre processos"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS metrics ("
+                "name TEXT, labels TEXT, value REAL, PRIMARY KEY (name, labels))"
+            )
+
+    def _connect(self):
+        # Uma conexão por operação: seguro entre threads e processos
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _apply(self, increments, maximums=()):
+        """Soma os incrementos e atualiza os máximos numa única transação"""
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                [(name, json.dumps(labels, sort_keys=True), value) for name, labels, value in increments]
+            )
+            connection.executemany(
+                "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = max(value, excluded.value)",
+                [(name, json.dumps(labels, sort_keys=True), value) for name, labels, value in maximums]
+            )
+
+    def observe_job(self, kind, status, duration, metrics=None):
+        """
+        Registra um job encerrado.
+
+        Args:
+            kind (str): Tipo do job ("single", "batch" ou "stream")
+            status (str): Status final ("done" ou "failed")
+            duration (float): Duração do job em segundos
+            metrics (dict or None): Medições da conversão (ver conversion_metrics)
+        """
+        increments = [("kml_jobs_total", {"kind": kind, "status": status}, 1),
+                      ("kml_job_duration_seconds_sum", {"kind": kind}, duration),
+                      ("kml_job_duration_seconds_count", {"kind": kind}, 1)]
+        # Buckets cumulativos: o job conta em todos os limites maiores ou iguais à
+        # duração (os demais recebem 0, para que todos os buckets existam)
+        increments.extend(("kml_job_duration_seconds_bucket", {"kind": kind, "le": _format_value(bound)},
+                           1 if duration <= bound else 0)
+                          for bound in JOB_DURATION_BUCKETS)
+        if metrics:
+            for stage, seconds in metrics.get("timings", {}).items():
+                increments.append(("kml_stage_seconds_total", {"stage": stage}, seconds))
+            for status_name, count in metrics.get("files", {}).items():
+                increments.append(("kml_files_total", {"status": status_name}, count))
+            for result, count in metrics.get("cache", {}).items():
+                increments.append(("kml_cache_requests_total", {"result": result}, count))
+            for name, key in (("kml_input_bytes_total", "bytes_read"), ("kml_output_bytes_total", "bytes_written"),
+                              ("kml_vertices_in_total", "vertices_in"), ("kml_vertices_out_total", "vertices_out"),
+                              ("kml_rows_written_total", "rows_written")):
+                increments.append((name, {}, metrics.get(key, 0)))
+        self._apply(increments)
+
+    def observe_process(self, peak_rss_bytes):
+        """
+        Registra o pico de memória de um processo do serviço.
+
+        Args:
+            peak_rss_bytes (int or None): Ver process_peak_rss_bytes (None é ignorado)
+        """
+        if peak_rss_bytes:
+            self._apply((), [("kml_process_peak_rss_bytes", {}, peak_rss_bytes)])
+
+    def render(self, active_jobs=None):
+        """
+        Gera o texto de /metrics.
+
+        Args:
+            active_jobs (dict or None): Jobs em andamento por status (ex.: {"queued": 2})
+
+        Returns:
+            str: Métricas no formato texto do Prometheus (versão 0.0.4)
+        """
+        with self._connect() as connection:
+            rows = connection.execute("SELECT name, labels, value FROM metrics").fetchall()
+        samples = {}
+        for name, labels, value in rows:
+            samples.setdefault(name, []).append((json.loads(labels), value))
+        for status in ("queued", "running"):
+            samples.setdefault("kml_jobs_active", []).append(({"status": status}, (active_jobs or {}).get(status, 0)))
+
+        lines = []
+        for family, (metric_type, description) in METRICS.items():
+            names = [f"{family}_bucket", f"{family}_sum", f"{family}_count"] if metric_type == "histogram" else [family]
+            if not any(name in samples for name in names):
+                continue
+            lines.append(f"# HELP {family} {description}")
+            lines.append(f"# TYPE {family} {metric_type}")
+            for name in names:
+                # Ordem estável; buckets do menor para o maior limite
+                ordered = sorted(samples.get(name, []), key=lambda sample: (
+                    sorted((key, value) for key, value in sample[0].items() if key != "le"),
+                    float(sample[0].get("le", "0").replace("+Inf", "inf"))))
+                for labels, value in ordered:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
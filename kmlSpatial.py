@@ -0,0 +1,312 @@
+"""
+Filtro espacial e limpeza das coordenadas dos placemarks.
+
+Filtro por área: só os placemarks que tocam a área de interesse (um retângulo
+ou os polígonos de um KML de referência) são escritos; os demais são
+descartados antes de qualquer formatação do SQL. O teste é feito em três
+etapas, da mais barata para a mais cara:
+
+    1. o retângulo envolvente do placemark (calculado junto com as
+       coordenadas) contra os retângulos dos polígonos de referência, numa
+       R-tree empacotada por STR (Sort-Tile-Recursive); com um único polígono
+       (ex.: o retângulo do --bbox), a comparação é direta, sem a árvore;
+    2. um vértice do placemark dentro do polígono (ou um vértice do polígono
+       dentro do placemark);
+    3. cruzamento entre as arestas, com as arestas do polígono de referência
+       indexadas noutra R-tree, de modo que polígonos de referência com
+       dezenas de milhares de vértices custam O(log n) por aresta consultada.
+
+Limpeza: vértices com latitude fora de [-90, 90] ou longitude fora de
+[-180, 180] e vértices repetidos em sequência são descartados.
+
+As coordenadas seguem o KML: longitude (x) e latitude (y) intercaladas.
+"""
+import hashlib
+import itertools
+import math
+import operator
+from array import array
+
+# Filhos por nó da R-tree
+NODE_CAPACITY = 16
+
+def parse_bbox(value):
+    """
+    Lê um retângulo "lon_min,lat_min,lon_max,lat_max".
+
+    Args:
+        value (str or sequence): Texto separado por vírgulas ou 4 números
+
+    Returns:
+        tuple: (lon_min, lat_min, lon_max, lat_max)
+
+    Raises:
+        ValueError: Se o retângulo for malformado, invertido ou fora dos
+            limites de latitude e longitude
+    """
+    parts = value.split(',') if isinstance(value, str) else list(value)
+    if len(parts) != 4:
+        raise ValueError(f"bbox deve ter 4 valores (lon_min,lat_min,lon_max,lat_max): {value}")
+    try:
+        min_x, min_y, max_x, max_y = (float(part) for part in parts)
+    except (TypeError, ValueError):
+        raise ValueError(f"bbox com valor não numérico: {value}")
+    if min_x > max_x or min_y > max_y:
+        raise ValueError(f"bbox invertido (o mínimo deve vir antes do máximo): {value}")
+    if min_x < -180 or max_x > 180 or min_y < -90 or max_y > 90:
+        raise ValueError(f"bbox fora dos limites de longitude/latitude: {value}")
+    return min_x, min_y, max_x, max_y
+
+def file_digest(path):
+    """sha256 do conteúdo de um arquivo (identifica o KML de referência no cache e no manifesto)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as reference:
+        for block in iter(lambda: reference.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def bounds(coordinates):
+    """
+    Retângulo envolvente de um array de coordenadas.
+
+    Args:
+        coordinates (array): Valores x, y intercalados (não vazio)
+
+    Returns:
+        tuple: (min_x, min_y, max_x, max_y)
+    """
+    xs = coordinates[0::2]
+    ys = coordinates[1::2]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def _boxes_touch(a, b):
+    """Os retângulos (min_x, min_y, max_x, max_y) se tocam"""
+    return not (a[0] > b[2] or a[2] < b[0] or a[1] > b[3] or a[3] < b[1])
+
+def clean_coordinates(coordinates):
+    """
+    Descarta vértices fora dos limites de latitude/longitude e repetidos em sequência.
+
+    No caso comum (nada a descartar) o array original é devolvido sem cópia;
+    os testes de limites e de repetição rodam em bloco sobre as colunas.
+
+    Args:
+        coordinates (array): Valores x, y intercalados
+
+    Returns:
+        tuple: (array limpo, número de vértices descartados)
+    """
+    if not coordinates:
+        return coordinates, 0
+    xs = coordinates[0::2]
+    ys = coordinates[1::2]
+    in_range = min(xs) >= -180 and max(xs) <= 180 and min(ys) >= -90 and max(ys) <= 90
+    points = list(zip(xs, ys))
+    if in_range and not any(map(operator.eq, points, itertools.islice(points, 1, None))):
+        return coordinates, 0
+
+    cleaned = array('d')
+    previous = None
+    for point in points:
+        x, y = point
+        if not (-180 <= x <= 180 and -90 <= y <= 90) or point == previous:
+            continue
+        cleaned.append(x)
+        cleaned.append(y)
+        previous = point
+    return cleaned, len(points) - len(cleaned) // 2
+
+class STRtree:
+    """
+    R-tree estática empacotada por STR (Sort-Tile-Recursive).
+
+    Os retângulos são ordenados pelo centro em x, divididos em faixas
+    verticais e, dentro de cada faixa, ordenados em y e agrupados em nós de
+    NODE_CAPACITY filhos; o mesmo empacotamento se repete nível a nível até
+    a raiz. A árvore é montada uma única vez e só atende consultas.
+    """
+
+    def __init__(self, boxes, node_capacity=NODE_CAPACITY):
+        """
+        Args:
+            boxes (list): Retângulos (min_x, min_y, max_x, max_y); as consultas
+                devolvem a posição de cada um nesta lista
+            node_capacity (int): Filhos por nó
+        """
+        self.boxes = boxes
+        self._capacity = node_capacity
+        # Cada nível é uma lista de nós (retângulo, filhos); as folhas
+        # apontam para posições em boxes, os demais para nós do nível abaixo
+        self._levels = []
+        entries = [(box, index) for index, box in enumerate(boxes)]
+        while entries:
+            nodes = self._pack(entries)
+            self._levels.append(nodes)
+            if len(nodes) == 1:
+                break
+            entries = [(box, index) for index, (box, _children) in enumerate(nodes)]
+
+    def _pack(self, entries):
+        capacity = self._capacity
+        node_count = math.ceil(len(entries) / capacity)
+        slice_count = math.ceil(math.sqrt(node_count))
+        slice_size = slice_count * capacity
+        entries = sorted(entries, key=lambda entry: entry[0][0] + entry[0][2])
+        nodes = []
+        for start in range(0, len(entries), slice_size):
+            tile = sorted(entries[start:start + slice_size], key=lambda entry: entry[0][1] + entry[0][3])
+            for node_start in range(0, len(tile), capacity):
+                group = tile[node_start:node_start + capacity]
+                box = (min(entry[0][0] for entry in group), min(entry[0][1] for entry in group),
+                       max(entry[0][2] for entry in group), max(entry[0][3] for entry in group))
+                nodes.append((box, [entry[1] for entry in group]))
+        return nodes
+
+    def query(self, box):
+        """
+        Posições dos retângulos que tocam o retângulo informado.
+
+        Args:
+            box (tuple): (min_x, min_y, max_x, max_y)
+
+        Yields:
+            int: Posição do retângulo em boxes
+        """
+        if not self._levels:
+            return
+        min_x, min_y, max_x, max_y = box
+        top = len(self._levels) - 1
+        stack = [(top, index) for index in range(len(self._levels[top]))]
+        while stack:
+            level, index = stack.pop()
+            node_box, children = self._levels[level][index]
+            if node_box[0] > max_x or node_box[2] < min_x or node_box[1] > max_y or node_box[3] < min_y:
+                continue
+            if level > 0:
+                stack.extend((level - 1, child) for child in children)
+                continue
+            for child in children:
+                child_box = self.boxes[child]
+                if not (child_box[0] > max_x or child_box[2] < min_x or
+                        child_box[1] > max_y or child_box[3] < min_y):
+                    yield child
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    """Sinal do produto vetorial (b - a) x (c - a): 1, -1 ou 0 se colineares"""
+    cross = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    return (cross > 0) - (cross < 0)
+
+def _on_segment(ax, ay, bx, by, cx, cy):
+    """c (colinear com a-b) está sobre o segmento a-b"""
+    return min(ax, bx) <= cx <= max(ax, bx) and min(ay, by) <= cy <= max(ay, by)
+
+def segments_intersect(ax, ay, bx, by, cx, cy, dx, dy):
+    """Os segmentos a-b e c-d se tocam (inclusive nas pontas ou sobrepostos)"""
+    o1 = _orientation(ax, ay, bx, by, cx, cy)
+    o2 = _orientation(ax, ay, bx, by, dx, dy)
+    o3 = _orientation(cx, cy, dx, dy, ax, ay)
+    o4 = _orientation(cx, cy, dx, dy, bx, by)
+    if o1 != o2 and o3 != o4:
+        return True
+    return ((o1 == 0 and _on_segment(ax, ay, bx, by, cx, cy)) or
+            (o2 == 0 and _on_segment(ax, ay, bx, by, dx, dy)) or
+            (o3 == 0 and _on_segment(cx, cy, dx, dy, ax, ay)) or
+            (o4 == 0 and _on_segment(cx, cy, dx, dy, bx, by)))
+
+def _ring_edges(coordinates):
+    """Arestas (x1, y1, x2, y2) do anel, fechando-o se o KML não repetir o primeiro vértice"""
+    count = len(coordinates) // 2
+    edges = [(coordinates[2 * i], coordinates[2 * i + 1], coordinates[2 * i + 2], coordinates[2 * i + 3])
+             for i in range(count - 1)]
+    if count > 2 and (coordinates[0], coordinates[1]) != (coordinates[-2], coordinates[-1]):
+        edges.append((coordinates[-2], coordinates[-1], coordinates[0], coordinates[1]))
+    return edges
+
+def _point_in_edges(x, y, edges):
+    """Ray casting: o ponto está dentro do anel formado pelas arestas"""
+    inside = False
+    for x1, y1, x2, y2 in edges:
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+class ReferencePolygon:
+    """Polígono de referência, com as arestas indexadas numa STRtree"""
+
+    def __init__(self, coordinates):
+        self.coordinates = coordinates
+        self.bounds = bounds(coordinates)
+        self.edges = _ring_edges(coordinates)
+        self._tree = STRtree([(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+                              for x1, y1, x2, y2 in self.edges])
+        # Retângulo alinhado aos eixos (ex.: bbox_polygon): o teste de ponto é só a comparação com bounds
+        self.rectangle = len(self.edges) == 4 and all(x1 == x2 or y1 == y2 for x1, y1, x2, y2 in self.edges)
+
+    def contains(self, x, y):
+        """O ponto está dentro do polígono (ray casting só sobre as arestas na altura de y)"""
+        if self.rectangle:
+            min_x, min_y, max_x, max_y = self.bounds
+            return min_x <= x <= max_x and min_y <= y <= max_y
+        edges = self.edges
+        crossing = [edges[index] for index in self._tree.query((x, y, math.inf, y))]
+        return _point_in_edges(x, y, crossing)
+
+    def touches(self, coordinates, box):
+        """
+        O placemark toca o polígono (um dentro do outro ou arestas cruzadas).
+
+        Args:
+            coordinates (array): Valores x, y intercalados do placemark
+            box (tuple): Retângulo envolvente do placemark (ver bounds)
+        """
+        if self.contains(coordinates[0], coordinates[1]):
+            return True
+        if self.rectangle and _boxes_touch(self.bounds, box) and (
+                box[0] >= self.bounds[0] and box[2] <= self.bounds[2] or
+                box[1] >= self.bounds[1] and box[3] <= self.bounds[3]):
+            # O placemark atravessa uma faixa do retângulo de lado a lado (ou está dentro dele)
+            return True
+        edges = self.edges
+        for ax, ay, bx, by in _ring_edges(coordinates):
+            segment_box = (min(ax, bx), min(ay, by), max(ax, bx), max(ay, by))
+            for index in self._tree.query(segment_box):
+                if segments_intersect(ax, ay, bx, by, *edges[index]):
+                    return True
+        # Sem cruzamento: resta o polígono de referência inteiro dentro do placemark
+        px, py = self.coordinates[0], self.coordinates[1]
+        if not (box[0] <= px <= box[2] and box[1] <= py <= box[3]):
+            return False
+        return len(coordinates) >= 6 and _point_in_edges(px, py, _ring_edges(coordinates))
+
+def bbox_polygon(bbox):
+    """Anel retangular de um bbox (ver parse_bbox), no formato das coordenadas do KML"""
+    min_x, min_y, max_x, max_y = bbox
+    return array('d', [min_x, min_y, max_x, min_y, max_x, max_y, min_x, max_y, min_x, min_y])
+
+class SpatialFilter:
+    """Área de interesse: um conjunto de polígonos indexados por uma STRtree"""
+
+    def __init__(self, polygons):
+        """
+        Args:
+            polygons (list): Anéis da área (arrays de coordenadas intercaladas)
+        """
+        self.polygons = [ReferencePolygon(coordinates) for coordinates in polygons if len(coordinates) >= 2]
+        # Com um único polígono, a árvore só acrescentaria níveis a uma comparação de retângulos
+        self._tree = STRtree([polygon.bounds for polygon in self.polygons]) if len(self.polygons) > 1 else None
+
+    def matches(self, coordinates):
+        """
+        O placemark toca a área de interesse.
+
+        Args:
+            coordinates (array): Valores x, y intercalados (não vazio)
+
+        Returns:
+            bool: True se algum polígono da área toca o placemark
+        """
+        box = bounds(coordinates)
+        if self._tree is None:
+            return any(polygon.touches(coordinates, box) for polygon in self.polygons
+                       if _boxes_touch(polygon.bounds, box))
+        return any(self.polygons[index].touches(coordinates, box) for index in self._tree.query(box))
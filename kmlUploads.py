@@ -0,0 +1,220 @@
+"""
+Envio de lotes grandes em partes (chunks), com retomada.
+
+Protocolo (rotas em app.py):
+    POST /api/uploads                         declara os arquivos (nome, tamanho e,
+                                              opcionalmente, o sha256 de cada um)
+    PUT  /api/uploads/<id>/<arquivo>?offset=N acrescenta uma parte ao arquivo
+                                              (cabeçalho X-Chunk-SHA256 opcional)
+    GET  /api/uploads/<id>                    bytes já recebidos de cada arquivo
+    POST /api/uploads/<id>/filter-polygon     KML de referência do filtro espacial
+                                              (opcional, antes das partes)
+    POST /api/uploads/<id>/complete           enfileira a conversão do lote
+
+Cada parte é gravada direto na pasta do job, num arquivo <nome>.part que só
+ganha o nome final quando está completo (e confere com o sha256 declarado).
+O estado do envio fica todo em disco (upload.json e o tamanho dos arquivos),
+de modo que qualquer processo do gunicorn atende qualquer parte e um envio
+interrompido é retomado a partir do último byte gravado. As partes de um
+mesmo arquivo devem ser enviadas em sequência.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+MANIFEST_NAME = "upload.json"
+PART_SUFFIX = ".part"
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+class UploadError(Exception):
+    """Erro do protocolo de envio, com o status HTTP a devolver"""
+
+    def __init__(self, message, status=400, received=None):
+        super().__init__(message)
+        self.status = status
+        # Bytes já gravados do arquivo, para o cliente retomar do ponto certo
+        self.received = received
+
+def create_upload(upload_dir, files, settings):
+    """
+    Registra um envio em partes.
+
+    Args:
+        upload_dir (str): Pasta do job (já criada)
+        files (list): [{"name": str, "size": int, "sha256": str or None}], com
+            nomes já sanitizados
+        settings (dict): Opções da conversão, guardadas para a conclusão
+
+    Returns:
+        dict: Manifesto do envio
+
+    Raises:
+        UploadError: Se a lista de arquivos for inválida
+    """
+    if not files:
+        raise UploadError("Nenhum arquivo declarado")
+    names = set()
+    for entry in files:
+        if entry["name"] in names:
+            raise UploadError(f"Arquivo declarado mais de uma vez: {entry['name']}")
+        if entry["size"] < 0:
+            raise UploadError(f"Tamanho inválido para {entry['name']}")
+        names.add(entry["name"])
+
+    manifest = {"files": files, "settings": settings}
+    _write_manifest(upload_dir, manifest)
+    # Arquivos vazios já estão completos
+    for entry in files:
+        if entry["size"] == 0:
+            open(os.path.join(upload_dir, entry["name"] + PART_SUFFIX), 'wb').close()
+            _finish_file(upload_dir, entry)
+    return manifest
+
+def _write_manifest(upload_dir, manifest):
+    # Grava num temporário e troca: outro processo lendo o manifesto nunca vê um JSON pela metade
+    descriptor, temp_path = tempfile.mkstemp(dir=upload_dir, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, ensure_ascii=False)
+        os.replace(temp_path, os.path.join(upload_dir, MANIFEST_NAME))
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def update_settings(upload_dir, manifest, **settings):
+    """
+    Altera opções da conversão de um envio ainda aberto.
+
+    Args:
+        upload_dir (str): Pasta do job
+        manifest (dict): Manifesto do envio (ver load_upload), atualizado in-place
+        **settings: Opções a substituir (ex.: filters)
+    """
+    manifest["settings"].update(settings)
+    _write_manifest(upload_dir, manifest)
+
+def load_upload(upload_dir):
+    """
+    Lê o manifesto de um envio.
+
+    Args:
+        upload_dir (str): Pasta do job
+
+    Returns:
+        dict or None: Manifesto, ou None se a pasta não for de um envio em partes
+    """
+    try:
+        with open(os.path.join(upload_dir, MANIFEST_NAME), 'r', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+def received_bytes(upload_dir, name):
+    """
+    Bytes já recebidos de um arquivo.
+
+    Returns:
+        tuple: (bytes recebidos, True se o arquivo está completo)
+    """
+    path = os.path.join(upload_dir, name)
+    if os.path.exists(path):
+        return os.path.getsize(path), True
+    try:
+        return os.path.getsize(path + PART_SUFFIX), False
+    except OSError:
+        return 0, False
+
+def upload_status(upload_dir, manifest):
+    """
+    Situação de cada arquivo do envio.
+
+    Args:
+        upload_dir (str): Pasta do job
+        manifest (dict): Manifesto do envio (ver load_upload)
+
+    Returns:
+        list: [{"name", "size", "received", "complete"}], na ordem declarada
+    """
+    status = []
+    for entry in manifest["files"]:
+        received, complete = received_bytes(upload_dir, entry["name"])
+        status.append({"name": entry["name"], "size": entry["size"], "received": received, "complete": complete})
+    return status
+
+def append_chunk(upload_dir, manifest, name, offset, stream, length, checksum=None):
+    """
+    Grava uma parte de um arquivo, lida em blocos direto do corpo da requisição.
+
+    Args:
+        upload_dir (str): Pasta do job
+        manifest (dict): Manifesto do envio
+        name (str): Nome do arquivo (como declarado)
+        offset (int): Posição da parte no arquivo; deve ser igual aos bytes já recebidos
+        stream: Corpo da requisição (objeto com read)
+        length (int): Tamanho da parte em bytes
+        checksum (str or None): sha256 hexadecimal esperado para a parte
+
+    Returns:
+        tuple: (bytes recebidos do arquivo, True se a parte completou o arquivo)
+
+    Raises:
+        UploadError: Arquivo não declarado, posição errada, parte maior que o
+            arquivo, parte incompleta ou checksum divergente (a parte é descartada)
+    """
+    entry = next((entry for entry in manifest["files"] if entry["name"] == name), None)
+    if entry is None:
+        raise UploadError(f"Arquivo não declarado no envio: {name}", 404)
+    received, complete = received_bytes(upload_dir, name)
+    if complete:
+        raise UploadError(f"O arquivo {name} já foi recebido", 409, received)
+    if offset != received:
+        raise UploadError(f"Posição inesperada: o arquivo {name} tem {received} bytes recebidos", 409, received)
+    if offset + length > entry["size"]:
+        raise UploadError(f"A parte ultrapassa o tamanho declarado de {name} ({entry['size']} bytes)", 400, received)
+
+    digest = hashlib.sha256() if checksum else None
+    remaining = length
+    part_path = os.path.join(upload_dir, name + PART_SUFFIX)
+    with open(part_path, 'ab') as part_file:
+        try:
+            while remaining > 0:
+                block = stream.read(min(_COPY_CHUNK_SIZE, remaining))
+                if not block:
+                    raise UploadError(f"Parte incompleta: faltaram {remaining} bytes", 400, offset)
+                if digest is not None:
+                    digest.update(block)
+                part_file.write(block)
+                remaining -= len(block)
+            if digest is not None and digest.hexdigest() != checksum.lower():
+                raise UploadError("O checksum da parte não confere", 400, offset)
+        except BaseException:
+            # Descarta a parte inteira: o cliente a reenvia a partir de offset
+            part_file.truncate(offset)
+            raise
+
+    # Mantém a pasta recente para a coleta de expirados enquanto o envio avança
+    os.utime(upload_dir)
+    received = offset + length
+    if received < entry["size"]:
+        return received, False
+    _finish_file(upload_dir, entry)
+    return received, True
+
+def _finish_file(upload_dir, entry):
+    """Confere o sha256 declarado e dá ao arquivo completo o nome final"""
+    part_path = os.path.join(upload_dir, entry["name"] + PART_SUFFIX)
+    if entry.get("sha256"):
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as part_file:
+            for block in iter(lambda: part_file.read(_COPY_CHUNK_SIZE), b''):
+                digest.update(block)
+        if digest.hexdigest() != entry["sha256"].lower():
+            os.remove(part_path)
+            raise UploadError(f"O checksum de {entry['name']} não confere; reenvie o arquivo", 400, 0)
+    os.replace(part_path, os.path.join(upload_dir, entry["name"]))
+
+def pending_files(upload_dir, manifest):
+    """Nomes dos arquivos declarados que ainda não foram recebidos por completo"""
+    return [entry["name"] for entry in manifest["files"] if not received_bytes(upload_dir, entry["name"])[1]]
@@ -0,0 +1,74 @@
+"""
+Registro das zonas de uma saída ou de um lote do KML to SQL Converter.
+
+Uma zona é identificada pelo nome da camada. Vários placemarks com a mesma
+camada formam uma única zona com vários anéis (polígonos), mantidos na ordem
+em que aparecem: o INSERT da zona é escrito uma única vez por saída, antes das
+coordenadas do primeiro anel, e as coordenadas dos anéis seguintes continuam
+a numeração dos anteriores.
+
+Os nomes são internados (sys.intern): um nome repetido em milhares de
+placemarks ocupa memória uma única vez.
+"""
+import sys
+
+class ZonaRegistry:
+    """Zonas na ordem da primeira aparição, com os anéis (placemarks) de cada uma"""
+
+    def __init__(self):
+        self._zonas = {}
+
+    def __len__(self):
+        return len(self._zonas)
+
+    def add_ring(self, name, vertices, source=None):
+        """
+        Registra um placemark como o próximo anel da zona.
+
+        Args:
+            name (str): Nome da zona
+            vertices (int): Número de vértices do anel
+            source (str or None): Arquivo KML de origem (registro de um lote)
+
+        Returns:
+            dict: {"zona": nome internado, "ring": posição do anel na zona
+                   (a partir de 1), "offset": vértices dos anéis anteriores}
+        """
+        zona = self._zonas.get(name)
+        if zona is None:
+            name = sys.intern(name)
+            zona = self._zonas[name] = {"name": name, "source": source, "rings": [], "vertices": 0}
+        # Devolve sempre a cópia internada do nome
+        ring = {"zona": zona["name"], "ring": len(zona["rings"]) + 1, "offset": zona["vertices"]}
+        zona["rings"].append(vertices)
+        zona["vertices"] += vertices
+        return ring
+
+    def to_dict(self):
+        """
+        Exporta as zonas para o resultado de uma conversão (serializável em JSON).
+
+        Returns:
+            dict: {nome: [vértices de cada anel]}, na ordem da primeira aparição
+        """
+        return {name: list(zona["rings"]) for name, zona in self._zonas.items()}
+
+    def merge(self, zonas, source):
+        """
+        Acrescenta ao lote as zonas de um arquivo convertido.
+
+        Args:
+            zonas (dict): Zonas do arquivo (ver to_dict)
+            source (str): Arquivo KML de origem
+
+        Returns:
+            list: Zonas do arquivo que já vinham de arquivos anteriores do lote
+        """
+        shared = []
+        for name, rings in zonas.items():
+            zona = self._zonas.get(name)
+            if zona is not None and zona["source"] != source:
+                shared.append(name)
+            for vertices in rings:
+                self.add_ring(name, vertices, source)
+        return shared
@@ -4,7 +4,8 @@
 echo "Starting KML to SQL Converter..."
 
 # Create directories if they don't exist
-mkdir -p uploads results
+mkdir -p uploads results cache
 
 # Start the application with Gunicorn (increased timeout and fewer workers for better stability)
-exec gunicorn --bind 0.0.0.0:5000 --workers 2 --timeout 600 --max-requests 1000 --preload app:app
+# No --max-requests: recycling a worker would kill the conversions running in its job threads
+exec gunicorn --bind 0.0.0.0:5000 --workers 2 --threads 4 --timeout 600 --preload app:app
@@ -0,0 +1,67 @@
+"""Formato colunar (.kcol): gravação e leitura"""
+import io
+from array import array
+
+import pytest
+
+import kmlColumnar
+
+RINGS = [
+    ("CENTRO", array("d", [-39.1, -7.1, -39.2, -7.1, -39.2, -7.2, -39.1, -7.1])),
+    ("NORTE", array("d", [-39.5, -6.5, -39.6, -6.5, -39.6, -6.6, -39.5, -6.5])),
+    ("CENTRO", array("d", [-39.3, -7.3, -39.4, -7.3, -39.4, -7.4, -39.3, -7.3])),
+    ("SUL", array("d", [0.123456789, -89.987654321])),
+]
+
+def _write(path, row_group_vertices=kmlColumnar.ROW_GROUP_VERTICES):
+    with open(path, "wb") as stream:
+        writer = kmlColumnar.ColumnarWriter(stream, source="zonas.kml", row_group_vertices=row_group_vertices)
+        for zona, coordinates in RINGS:
+            writer.add_ring(zona, coordinates)
+        writer.finish()
+    return writer
+
+@pytest.mark.parametrize("row_group_vertices", [kmlColumnar.ROW_GROUP_VERTICES, 3])
+def test_round_trip(tmp_path, row_group_vertices):
+    path = tmp_path / "zonas.kcol"
+    writer = _write(path, row_group_vertices)
+    assert writer.rings == 4
+    assert writer.vertices == 13
+
+    with kmlColumnar.ColumnarReader(str(path)) as reader:
+        assert reader.source == "zonas.kml"
+        assert reader.zonas == ["CENTRO", "NORTE", "SUL"]
+        assert (reader.rings, reader.vertices) == (4, 13)
+        progress = []
+        rings = list(reader.iter_rings(lambda done, total: progress.append((done, total))))
+
+    # Os valores voltam exatos (float64), na ordem gravada
+    assert rings == RINGS
+    assert progress and progress[-1][1] == path.stat().st_size
+
+def test_is_columnar():
+    assert kmlColumnar.is_columnar("dados/ZONAS.KCOL")
+    assert not kmlColumnar.is_columnar("zonas.kml")
+
+@pytest.mark.parametrize("cut", [1, 20])
+def test_truncated_file_is_rejected(tmp_path, cut):
+    path = tmp_path / "zonas.kcol"
+    _write(path)
+    data = path.read_bytes()
+    path.write_bytes(data[:-cut])
+    with pytest.raises(ValueError):
+        kmlColumnar.ColumnarReader(str(path))
+
+def test_not_columnar_file_is_rejected(tmp_path):
+    path = tmp_path / "zonas.kcol"
+    path.write_bytes(b"<?xml version='1.0'?><kml></kml>" * 4)
+    with pytest.raises(ValueError):
+        kmlColumnar.ColumnarReader(str(path))
+
+def test_writer_leaves_stream_open():
+    stream = io.BytesIO()
+    writer = kmlColumnar.ColumnarWriter(stream)
+    writer.add_ring("CENTRO", RINGS[0][1])
+    writer.finish()
+    assert stream.getvalue().startswith(kmlColumnar.MAGIC)
+    assert stream.getvalue().endswith(kmlColumnar.MAGIC)
@@ -0,0 +1,82 @@
+"""Carga direta no SQLite: ida e volta pelo conversor e erros que justificam nova tentativa"""
+import sqlite3
+
+import pytest
+
+import kmlDatabase
+import kmlToSql
+
+KML = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document>
+<Placemark><ExtendedData><Data name="zona"><value>CENTRO</value></Data></ExtendedData>
+<Polygon><outerBoundaryIs><LinearRing><coordinates>
+-39.1,-7.1,0 -39.2,-7.1,0 -39.2,-7.2,0 -39.1,-7.1,0
+</coordinates></LinearRing></outerBoundaryIs></Polygon></Placemark>
+<Placemark><ExtendedData><Data name="zona"><value>NORTE</value></Data></ExtendedData>
+<Polygon><outerBoundaryIs><LinearRing><coordinates>
+-39.5,-6.5 -39.6,-6.5 -39.6,-6.6 -39.5,-6.5
+</coordinates></LinearRing></outerBoundaryIs></Polygon></Placemark>
+<Placemark><ExtendedData><Data name="zona"><value>CENTRO</value></Data></ExtendedData>
+<Polygon><outerBoundaryIs><LinearRing><coordinates>
+-39.3,-7.3 -39.4,-7.3 -39.4,-7.4 -39.3,-7.3
+</coordinates></LinearRing></outerBoundaryIs></Polygon></Placemark>
+</Document></kml>
+"""
+
+@pytest.fixture
+def database(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'zonas.db'}"
+    kmlDatabase.create_schema(database_url)
+    yield database_url, tmp_path / "zonas.db"
+    kmlDatabase.close_pools()
+
+def _convert(tmp_path, database_url, batch_size=1000):
+    kml_path = tmp_path / "zonas.kml"
+    kml_path.write_text(KML, encoding="utf-8")
+    return kmlToSql.convert_kml_file(str(kml_path), {"output_format": "database", "database_url": database_url,
+                                                     "batch_size": batch_size})
+
+@pytest.mark.parametrize("batch_size", [1000, 3])
+def test_sqlite_round_trip(tmp_path, database, batch_size):
+    database_url, path = database
+    result = _convert(tmp_path, database_url, batch_size)
+    assert result["status"] == "success"
+
+    with sqlite3.connect(path) as connection:
+        zonas = connection.execute("SELECT id, nome FROM zona ORDER BY id").fetchall()
+        rows = connection.execute("SELECT latitude, longitude, id_zona FROM coordenada ORDER BY id").fetchall()
+
+    # Uma zona por nome, na ordem do arquivo; os anéis de CENTRO ficam na mesma zona
+    assert [nome for _id, nome in zonas] == ["CENTRO", "NORTE"]
+    ids = {nome: zona_id for zona_id, nome in zonas}
+    assert len(rows) == 12
+    # Latitude recebe o segundo valor de cada par do KML, na ordem dos placemarks
+    assert rows[:4] == [(-7.1, -39.1, ids["CENTRO"]), (-7.1, -39.2, ids["CENTRO"]),
+                        (-7.2, -39.2, ids["CENTRO"]), (-7.1, -39.1, ids["CENTRO"])]
+    assert [row[2] for row in rows[4:8]] == [ids["NORTE"]] * 4
+    assert rows[8] == (-7.3, -39.3, ids["CENTRO"])
+
+def test_sqlite_reload_reuses_zonas(tmp_path, database):
+    database_url, path = database
+    _convert(tmp_path, database_url)
+    _convert(tmp_path, database_url)
+
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM zona").fetchone()[0] == 2
+        assert connection.execute("SELECT COUNT(*) FROM coordenada").fetchone()[0] == 24
+
+def test_sqlite_retryable_errors():
+    database_url = "sqlite:///zonas.db"
+    assert kmlDatabase.is_retryable(database_url, sqlite3.OperationalError("database is locked"))
+    assert not kmlDatabase.is_retryable(database_url, sqlite3.OperationalError("no such table: zona"))
+    assert not kmlDatabase.is_retryable(database_url, sqlite3.IntegrityError("UNIQUE constraint failed"))
+    assert not kmlDatabase.is_retryable(database_url, ValueError("database is locked"))
+
+def test_missing_table_is_not_retried(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'vazio.db'}"
+    try:
+        result = _convert(tmp_path, database_url)
+    finally:
+        kmlDatabase.close_pools()
+    assert result["status"] == "error"
+    assert "no such table" in result["errors"][0]
@@ -0,0 +1,58 @@
+"""Manifesto da conversão incremental: decisões WRITE / SKIP / DELETE_AND_WRITE"""
+from array import array
+
+import kmlManifest
+from kmlManifest import DELETE_AND_WRITE, SKIP, WRITE
+
+FINGERPRINT = {"output_format": "sql"}
+
+CENTRO = array("d", [-39.1, -7.1, -39.2, -7.1, -39.2, -7.2, -39.1, -7.1])
+CENTRO_2 = array("d", [-39.3, -7.3, -39.4, -7.3, -39.4, -7.4, -39.3, -7.3])
+NORTE = array("d", [-39.5, -6.5, -39.6, -6.5, -39.6, -6.6, -39.5, -6.5])
+MOVED = array("d", [-40.5, -6.5, -40.6, -6.5, -40.6, -6.6, -40.5, -6.5])
+
+def _run(path, placemarks, fingerprint=FINGERPRINT):
+    """Simula uma conversão: decisões por placemark, resultado de finish() e resumo"""
+    delta = kmlManifest.ManifestDelta(str(path), fingerprint)
+    decisions = [delta.check(layer, coordinates) for layer, coordinates in placemarks]
+    finished = delta.finish()
+    delta.save()
+    return decisions, finished, delta.summary()
+
+def test_first_conversion_rewrites_everything(tmp_path):
+    path = kmlManifest.manifest_path(str(tmp_path), "zonas")
+    decisions, finished, _summary = _run(path, [("CENTRO", CENTRO), ("NORTE", NORTE), ("CENTRO", CENTRO_2)])
+    # Sem manifesto anterior, cada zona é apagada e escrita; os anéis seguintes só escritos
+    assert decisions == [DELETE_AND_WRITE, DELETE_AND_WRITE, WRITE]
+    assert finished == ([], [])
+
+def test_unchanged_zonas_are_skipped(tmp_path):
+    path = kmlManifest.manifest_path(str(tmp_path), "zonas")
+    placemarks = [("CENTRO", CENTRO), ("NORTE", NORTE), ("CENTRO", CENTRO_2)]
+    _run(path, placemarks)
+    decisions, finished, summary = _run(path, placemarks)
+    assert decisions == [SKIP, SKIP, SKIP]
+    assert finished == ([], [])
+    assert summary == {"added": 0, "changed": 0, "removed": 0, "unchanged": 2}
+
+def test_changed_added_and_removed_zonas(tmp_path):
+    path = kmlManifest.manifest_path(str(tmp_path), "zonas")
+    _run(path, [("CENTRO", CENTRO), ("NORTE", NORTE)])
+    decisions, finished, summary = _run(path, [("CENTRO", MOVED), ("SUL", CENTRO_2)])
+    assert decisions == [DELETE_AND_WRITE, WRITE]
+    assert finished == ([], ["NORTE"])
+    assert summary == {"added": 1, "changed": 1, "removed": 1, "unchanged": 0}
+
+def test_change_after_skipped_ring_is_deferred(tmp_path):
+    path = kmlManifest.manifest_path(str(tmp_path), "zonas")
+    _run(path, [("CENTRO", CENTRO), ("CENTRO", CENTRO_2)])
+    decisions, finished, _summary = _run(path, [("CENTRO", CENTRO), ("CENTRO", MOVED)])
+    # O primeiro anel já foi pulado: a zona inteira é reescrita numa segunda passada
+    assert decisions == [SKIP, SKIP]
+    assert finished == (["CENTRO"], [])
+
+def test_other_options_invalidate_the_manifest(tmp_path):
+    path = kmlManifest.manifest_path(str(tmp_path), "zonas")
+    _run(path, [("CENTRO", CENTRO)])
+    decisions, _finished, _summary = _run(path, [("CENTRO", CENTRO)], {"output_format": "copy"})
+    assert decisions == [DELETE_AND_WRITE]
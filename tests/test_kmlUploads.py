@@ -0,0 +1,72 @@
+"""Envio em partes: posição e checksum de cada parte"""
+import hashlib
+import io
+
+import pytest
+
+import kmlUploads
+from kmlUploads import UploadError
+
+DATA = b"<kml>" + b"0123456789" * 10 + b"</kml>"
+
+@pytest.fixture
+def upload(tmp_path):
+    files = [{"name": "zonas.kml", "size": len(DATA), "sha256": hashlib.sha256(DATA).hexdigest()}]
+    manifest = kmlUploads.create_upload(str(tmp_path), files, {"output_format": "sql"})
+    return str(tmp_path), manifest
+
+def _append(upload_dir, manifest, offset, data, checksum=None, name="zonas.kml"):
+    return kmlUploads.append_chunk(upload_dir, manifest, name, offset, io.BytesIO(data), len(data), checksum)
+
+def test_chunks_complete_the_file(upload):
+    upload_dir, manifest = upload
+    assert _append(upload_dir, manifest, 0, DATA[:50]) == (50, False)
+    assert _append(upload_dir, manifest, 50, DATA[50:], hashlib.sha256(DATA[50:]).hexdigest()) == (len(DATA), True)
+    assert kmlUploads.pending_files(upload_dir, manifest) == []
+    assert kmlUploads.upload_status(upload_dir, manifest)[0]["complete"]
+
+def test_wrong_offset_is_rejected(upload):
+    upload_dir, manifest = upload
+    _append(upload_dir, manifest, 0, DATA[:50])
+    with pytest.raises(UploadError) as error:
+        _append(upload_dir, manifest, 40, DATA[40:])
+    assert (error.value.status, error.value.received) == (409, 50)
+    with pytest.raises(UploadError) as error:
+        _append(upload_dir, manifest, 60, DATA[60:])
+    assert (error.value.status, error.value.received) == (409, 50)
+    assert kmlUploads.received_bytes(upload_dir, "zonas.kml") == (50, False)
+
+def test_chunk_checksum_mismatch_discards_the_chunk(upload):
+    upload_dir, manifest = upload
+    _append(upload_dir, manifest, 0, DATA[:50])
+    with pytest.raises(UploadError) as error:
+        _append(upload_dir, manifest, 50, DATA[50:], hashlib.sha256(b"outra parte").hexdigest())
+    assert (error.value.status, error.value.received) == (400, 50)
+    # A parte recusada não fica gravada: o envio continua de onde estava
+    assert kmlUploads.received_bytes(upload_dir, "zonas.kml") == (50, False)
+    assert _append(upload_dir, manifest, 50, DATA[50:]) == (len(DATA), True)
+
+def test_file_checksum_mismatch_restarts_the_file(tmp_path):
+    files = [{"name": "zonas.kml", "size": len(DATA), "sha256": hashlib.sha256(b"outro arquivo").hexdigest()}]
+    upload_dir = str(tmp_path)
+    manifest = kmlUploads.create_upload(upload_dir, files, {})
+    with pytest.raises(UploadError) as error:
+        _append(upload_dir, manifest, 0, DATA)
+    assert (error.value.status, error.value.received) == (400, 0)
+    assert kmlUploads.received_bytes(upload_dir, "zonas.kml") == (0, False)
+
+def test_oversized_and_undeclared_chunks_are_rejected(upload):
+    upload_dir, manifest = upload
+    with pytest.raises(UploadError) as error:
+        _append(upload_dir, manifest, 0, DATA + b"x")
+    assert error.value.status == 400
+    with pytest.raises(UploadError) as error:
+        _append(upload_dir, manifest, 0, DATA, name="outro.kml")
+    assert error.value.status == 404
+
+def test_short_body_is_rejected(upload):
+    upload_dir, manifest = upload
+    with pytest.raises(UploadError) as error:
+        kmlUploads.append_chunk(upload_dir, manifest, "zonas.kml", 0, io.BytesIO(DATA[:10]), 50)
+    assert (error.value.status, error.value.received) == (400, 0)
+    assert kmlUploads.received_bytes(upload_dir, "zonas.kml") == (0, False)